@@ -0,0 +1,91 @@
+'''Attack and ray tables, computed once at import so move generation and attack detection never repeat offset
+arithmetic or bounds checks. Square tables are indexed [row][col] and hold shared (row, col) tuples for the
+string-grid GameState; bitboard tables are indexed by square number row * 8 + col for the bitboard backend'''
+
+# one shared (row, col) tuple per square
+SQUARES = tuple(tuple((row, col) for col in range(8)) for row in range(8))
+# bitboard bit of each square, indexed [row][col]
+SQUARE_BITS = tuple(tuple(1 << (row * 8 + col) for col in range(8)) for row in range(8))
+ALL_SQUARES = (1 << 64) - 1
+
+# direction index -> (row delta, col delta). 0-3 are orthogonal, 4-7 are diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+DIRECTION_INDEX = {direction: j for j, direction in enumerate(DIRECTIONS)}
+ORTHOGONAL = (0, 1, 2, 3)
+DIAGONAL = (4, 5, 6, 7)
+# directions where the square number increases when moving away from the origin
+POSITIVE_DIRECTIONS = (False, False, True, True, False, False, True, True)
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = DIRECTIONS
+# capture offsets of a pawn of each color
+PAWN_CAPTURE_OFFSETS = {'w': ((-1, -1), (-1, 1)), 'b': ((1, -1), (1, 1))}
+
+'''
+For every square, the tuple of on-board squares reached with the given offsets
+'''
+def _leaperSquares(offsets):
+    return tuple(tuple(tuple(SQUARES[row + dr][col + dc] for dr, dc in offsets
+                             if 0 <= row + dr < 8 and 0 <= col + dc < 8)
+                       for col in range(8)) for row in range(8))
+
+'''
+For every square and direction, the squares along the ray ordered outward from the square
+'''
+def _raySquares():
+    rays = []
+    for row in range(8):
+        rowRays = []
+        for col in range(8):
+            squareRays = []
+            for dr, dc in DIRECTIONS:
+                ray = []
+                endRow, endCol = row + dr, col + dc
+                while 0 <= endRow < 8 and 0 <= endCol < 8:
+                    ray.append(SQUARES[endRow][endCol])
+                    endRow += dr
+                    endCol += dc
+                squareRays.append(tuple(ray))
+            rowRays.append(tuple(squareRays))
+        rays.append(tuple(rowRays))
+    return tuple(rays)
+
+'''
+Bitboard with one bit set for each square in squares
+'''
+def _mask(squares):
+    bb = 0
+    for row, col in squares:
+        bb |= 1 << (row * 8 + col)
+    return bb
+
+KNIGHT_SQUARES = _leaperSquares(KNIGHT_OFFSETS)
+KING_SQUARES = _leaperSquares(KING_OFFSETS)
+# squares attacked by a pawn of the given color standing on [row][col]
+PAWN_ATTACK_SQUARES = {color: _leaperSquares(offsets) for color, offsets in PAWN_CAPTURE_OFFSETS.items()}
+# RAYS[row][col][direction] -> squares ordered outward
+RAYS = _raySquares()
+
+KNIGHT_ATTACKS = [_mask(KNIGHT_SQUARES[sq >> 3][sq & 7]) for sq in range(64)]
+KING_ATTACKS = [_mask(KING_SQUARES[sq >> 3][sq & 7]) for sq in range(64)]
+PAWN_ATTACKS = {color: [_mask(table[sq >> 3][sq & 7]) for sq in range(64)] for color, table in PAWN_ATTACK_SQUARES.items()}
+# RAY_MASKS[direction][sq] -> bitboard of the full ray, origin excluded
+RAY_MASKS = [[_mask(RAYS[sq >> 3][sq & 7][direction]) for sq in range(64)] for direction in range(8)]
+# every square a rook or bishop on sq reaches on an empty board
+ROOK_RAYS = [RAY_MASKS[0][sq] | RAY_MASKS[1][sq] | RAY_MASKS[2][sq] | RAY_MASKS[3][sq] for sq in range(64)]
+BISHOP_RAYS = [RAY_MASKS[4][sq] | RAY_MASKS[5][sq] | RAY_MASKS[6][sq] | RAY_MASKS[7][sq] for sq in range(64)]
+
+'''
+For every pair of squares on a common line, the squares strictly between them (0 for squares not on a line)
+'''
+def _betweenMasks():
+    masks = [[0] * 64 for sq in range(64)]
+    for sq in range(64):
+        for direction in range(8):
+            for row, col in RAYS[sq >> 3][sq & 7][direction]:
+                target = row * 8 + col
+                masks[sq][target] = RAY_MASKS[direction][sq] & ~RAY_MASKS[direction][target] & ~(1 << target)
+    return masks
+
+# BETWEEN_MASKS[sq][target] -> squares strictly between the two
+BETWEEN_MASKS = _betweenMasks()
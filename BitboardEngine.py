@@ -0,0 +1,745 @@
+from Move import Move, SQUARE_MASK, FLAGS_SHIFT, CASTLE_FLAG, ENPASSANT_FLAG, PROMOTION_FLAG
+from CastleRights import ALL_RIGHTS, NO_RIGHTS, WKS, WQS, BKS, BQS, CASTLE_MASKS, castleRightsOnBoard
+import Zobrist
+import Evaluation
+import Fen
+from DrawRules import DrawRules
+from AttackTables import SQUARES, ALL_SQUARES, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, RAY_MASKS, \
+    ROOK_RAYS, BISHOP_RAYS, BETWEEN_MASKS
+
+'''Alternate position backend for GameState built on 64-bit integer bitboards.
+Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1, matching the layout of board.
+It exposes the same makeMove/undoMove/getValidMovesAdvanced/board surface as ChessEngine.GameState,
+so it can be swapped in wherever the string-grid GameState is used. Moves are generated straight from check and
+pin masks, and the pieces are kept in a flat 64-square mailbox; the 8x8 board is only built when asked for'''
+
+# when True, makeMove/undoMove recompute the zobrist key from scratch and assert it matches the incremental key
+DEBUG_ZOBRIST = False
+UNDO_STACK_SIZE = 512
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+STARTING_BOARD = (
+    ('bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'),
+    ('bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'),
+    ('--', '--', '--', '--', '--', '--', '--', '--'),
+    ('--', '--', '--', '--', '--', '--', '--', '--'),
+    ('--', '--', '--', '--', '--', '--', '--', '--'),
+    ('--', '--', '--', '--', '--', '--', '--', '--'),
+    ('wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'),
+    ('wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR'),
+)
+ROW_MASKS = tuple(0xFF << (row * 8) for row in range(8))
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+# squares on the first and last rank, where pawn moves promote
+PROMOTION_SQUARES = ROW_MASKS[0] | ROW_MASKS[7]
+# flag bits of a promotion to each of Move.promotionPieces
+PROMOTION_CODES = tuple((PROMOTION_FLAG | j) << FLAGS_SHIFT for j in range(len(Move.promotionPieces)))
+
+# per direction ray masks. A ray is cut at its first blocker: the highest set bit on rays running towards lower
+# squares, the lowest on rays running towards higher squares
+NORTH, WEST, SOUTH, EAST, NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST = RAY_MASKS
+
+'''
+Squares a rook on sq attacks, including the first blocker in each direction. Unrolled, it is on the hot path
+'''
+def rookAttacks(sq, occupied):
+    attacks = 0
+    ray = NORTH[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ NORTH[blockers.bit_length() - 1] if blockers else ray
+    ray = WEST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ WEST[blockers.bit_length() - 1] if blockers else ray
+    ray = SOUTH[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ SOUTH[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = EAST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ EAST[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    return attacks
+
+'''
+Squares a bishop on sq attacks, unrolled like rookAttacks
+'''
+def bishopAttacks(sq, occupied):
+    attacks = 0
+    ray = NORTH_WEST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ NORTH_WEST[blockers.bit_length() - 1] if blockers else ray
+    ray = NORTH_EAST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ NORTH_EAST[blockers.bit_length() - 1] if blockers else ray
+    ray = SOUTH_WEST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ SOUTH_WEST[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    ray = SOUTH_EAST[sq]
+    blockers = ray & occupied
+    attacks |= ray ^ SOUTH_EAST[(blockers & -blockers).bit_length() - 1] if blockers else ray
+    return attacks
+
+def queenAttacks(sq, occupied):
+    return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+
+'''
+Yield the index of every set bit, lowest first
+'''
+def iterBits(bb):
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+class GameState(DrawRules):
+    def __init__(self):
+        # mailbox holds the piece on every square, indexed like the bitboards. board is a view built from it
+        self.mailbox = [piece for row in STARTING_BOARD for piece in row]
+        self.boardView = None
+        self.whiteToMove = True
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.inCheck = False
+        self.enpassantPossible = () # coordinates of square where possible. only 1 square on each move
+        self.currentCastleRights = ALL_RIGHTS # 4-bit WKS | WQS | BKS | BQS
+        self.halfmoveClock = 0 # plies since the last capture or pawn move
+        self.fullmoveNumber = 1 # starts at 1 and goes up after each black move
+        self.loadBitboards()
+        self.zobristKey = self.computeZobristKey()
+        # incrementally maintained middlegame and endgame scores (white's point of view) and game phase
+        self.mgScore, self.egScore, self.phase = Evaluation.computeScores(self.board)
+        # one [castle rights, en passant square, zobrist key, halfmove clock, mg score, eg score, phase] record per
+        # ply, reused in place by makeMove
+        self.undoStack = [[NO_RIGHTS, (), 0, 0, 0, 0, 0] for i in range(UNDO_STACK_SIZE)]
+
+    '''
+    The position as an 8x8 2d list like ChessEngine's board, built from the mailbox the first time it is asked for
+    after a move. Read only: changing it doesn't change the position, use setPosition for that
+    '''
+    @property
+    def board(self):
+        if self.boardView is None:
+            mailbox = self.mailbox
+            self.boardView = [mailbox[row * 8:row * 8 + 8] for row in range(8)]
+        return self.boardView
+
+    '''
+    piece -> set of (row, col) squares it stands on, like ChessEngine's pieceSquares. Built from the bitboards on
+    each call, so it doesn't follow later moves
+    '''
+    @property
+    def pieceSquares(self):
+        return {piece: {SQUARES[sq >> 3][sq & 7] for sq in iterBits(bb)} for piece, bb in self.pieces.items()}
+
+    '''
+    Zobrist key of the current position computed from scratch
+    '''
+    def computeZobristKey(self):
+        return Zobrist.computeKey(self.board, self.whiteToMove, self.currentCastleRights, self.enpassantPossible)
+
+    '''
+    Debug check that the incrementally maintained zobrist key matches a full recompute
+    '''
+    def checkZobristKey(self):
+        assert self.zobristKey == self.computeZobristKey(), "incremental zobrist key out of sync with the board"
+        assert (self.mgScore, self.egScore, self.phase) == Evaluation.computeScores(self.board), \
+            "incremental evaluation out of sync with the board"
+
+    '''
+    Rebuild the piece and occupancy bitboards from the mailbox
+    '''
+    def loadBitboards(self):
+        self.pieces = {piece: 0 for piece in PIECES}
+        self.occupancy = {'w': 0, 'b': 0}
+        for sq, piece in enumerate(self.mailbox):
+            if piece != '--':
+                self.pieces[piece] |= 1 << sq
+                self.occupancy[piece[0]] |= 1 << sq
+
+    '''
+    New GameState set up from a FEN string
+    '''
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls()
+        gs.setFen(fen)
+        return gs
+
+    '''
+    Replace the current position with the one described by a FEN string. The move log is cleared
+    '''
+    def setFen(self, fen):
+        self.setPosition(*Fen.parseFen(fen))
+
+    '''
+    Replace the current position with the given board (a list of 8 rows) and state. The move log is cleared
+    '''
+    def setPosition(self, board, whiteToMove, castleRights=NO_RIGHTS, enpassantPossible=(), halfmoveClock=0,
+                    fullmoveNumber=1):
+        # validate everything before the first field changes, so a bad position leaves the old one intact
+        Fen.checkBoard(board)
+        enpassantPossible = Fen.capturableEnpassant(board, whiteToMove, enpassantPossible)
+        self.mailbox = [piece for row in board for piece in row]
+        self.boardView = None
+        self.whiteToMove = whiteToMove
+        self.currentCastleRights = castleRightsOnBoard(board, castleRights)
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.loadBitboards()
+        self.zobristKey = self.computeZobristKey()
+        self.mgScore, self.egScore, self.phase = Evaluation.computeScores(self.board)
+
+    '''
+    FEN string of the current position
+    '''
+    def toFen(self):
+        return Fen.formatFen(self.board, self.whiteToMove, self.currentCastleRights, self.enpassantPossible,
+                             self.halfmoveClock, self.fullmoveNumber)
+
+    '''
+    Number of pieces of both colors on the board, kings included
+    '''
+    def pieceCount(self):
+        return (self.occupancy['w'] | self.occupancy['b']).bit_count()
+
+    @property
+    def whiteKingLocation(self):
+        return divmod(self.pieces['wK'].bit_length() - 1, 8)
+
+    @property
+    def blackKingLocation(self):
+        return divmod(self.pieces['bK'].bit_length() - 1, 8)
+
+    '''
+    Takes a move and executes it, including castling, pawn promotion and en-passant
+    '''
+    def makeMove(self, move):
+        pieces = self.pieces
+        occupancy = self.occupancy
+        mailbox = self.mailbox
+        piece = move.pieceMoved
+        packed = move.packed
+        flags = packed >> FLAGS_SHIFT
+        startSq = packed & SQUARE_MASK
+        endSq = (packed >> 6) & SQUARE_MASK
+        startRow, startCol, endRow, endCol = move.startRow, move.startCol, move.endRow, move.endCol
+        color = piece[0]
+        enemyColor = 'b' if color == 'w' else 'w'
+        startBit = 1 << startSq
+        endBit = 1 << endSq
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.extend([NO_RIGHTS, (), 0, 0, 0, 0, 0] for i in range(ply))
+        record = self.undoStack[ply]
+        record[0] = self.currentCastleRights
+        record[1] = self.enpassantPossible
+        record[2] = self.zobristKey
+        record[3] = self.halfmoveClock
+        record[4] = self.mgScore
+        record[5] = self.egScore
+        record[6] = self.phase
+        if piece[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if color == 'b':
+            self.fullmoveNumber += 1
+        pieceKeys = Zobrist.PIECE_KEYS
+        key = self.zobristKey ^ Zobrist.BLACK_TO_MOVE_KEY ^ pieceKeys[piece][startRow][startCol]
+        mgTables, egTables = Evaluation.MG_TABLES, Evaluation.EG_TABLES
+        mgScore = self.mgScore - mgTables[piece][startRow][startCol]
+        egScore = self.egScore - egTables[piece][startRow][startCol]
+
+        captured = move.pieceCaptured
+        if flags == ENPASSANT_FLAG:
+            capturedSq = startSq - startCol + endCol
+            pieces[captured] ^= 1 << capturedSq
+            occupancy[enemyColor] ^= 1 << capturedSq
+            mailbox[capturedSq] = '--'
+            key ^= pieceKeys[captured][startRow][endCol]
+            mgScore -= mgTables[captured][startRow][endCol]
+            egScore -= egTables[captured][startRow][endCol]
+        elif captured != '--':
+            pieces[captured] ^= endBit
+            occupancy[enemyColor] ^= endBit
+            key ^= pieceKeys[captured][endRow][endCol]
+            mgScore -= mgTables[captured][endRow][endCol]
+            egScore -= egTables[captured][endRow][endCol]
+            self.phase -= Evaluation.PHASES[captured]
+
+        occupancy[color] ^= startBit | endBit
+        mailbox[startSq] = '--'
+        if flags & PROMOTION_FLAG:
+            promoted = color + Move.promotionPieces[flags & 3]
+            pieces[piece] ^= startBit
+            pieces[promoted] ^= endBit
+            mailbox[endSq] = promoted
+            key ^= pieceKeys[promoted][endRow][endCol]
+            mgScore += mgTables[promoted][endRow][endCol]
+            egScore += egTables[promoted][endRow][endCol]
+            self.phase += Evaluation.PHASES[promoted]
+        else:
+            pieces[piece] ^= startBit | endBit
+            mailbox[endSq] = piece
+            key ^= pieceKeys[piece][endRow][endCol]
+            mgScore += mgTables[piece][endRow][endCol]
+            egScore += egTables[piece][endRow][endCol]
+
+        if flags == CASTLE_FLAG:
+            if endCol - startCol == 2: # kingside castle
+                rookFrom, rookTo = endCol + 1, endCol - 1
+            else: # queenside castle
+                rookFrom, rookTo = endCol - 2, endCol + 1
+            rook = color + 'R'
+            rowSq = endRow * 8
+            rookBits = (1 << (rowSq + rookFrom)) | (1 << (rowSq + rookTo))
+            pieces[rook] ^= rookBits
+            occupancy[color] ^= rookBits
+            mailbox[rowSq + rookTo] = rook
+            mailbox[rowSq + rookFrom] = '--'
+            key ^= pieceKeys[rook][endRow][rookFrom] ^ pieceKeys[rook][endRow][rookTo]
+            mgScore += mgTables[rook][endRow][rookTo] - mgTables[rook][endRow][rookFrom]
+            egScore += egTables[rook][endRow][rookTo] - egTables[rook][endRow][rookFrom]
+        self.mgScore = mgScore
+        self.egScore = egScore
+        self.boardView = None
+
+        if self.enpassantPossible != ():
+            key ^= Zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+        self.enpassantPossible = ()
+        if piece[1] == 'p' and (startSq - endSq == 16 or endSq - startSq == 16):
+            # only a square an enemy pawn can capture on counts, the same rule as Fen.capturableEnpassant
+            skippedSq = (startSq + endSq) >> 1
+            if PAWN_ATTACKS[color][skippedSq] & pieces[enemyColor + 'p']:
+                self.enpassantPossible = SQUARES[skippedSq >> 3][endCol]
+                key ^= Zobrist.ENPASSANT_KEYS[endCol]
+
+        castleRights = self.currentCastleRights & CASTLE_MASKS[startRow][startCol] & CASTLE_MASKS[endRow][endCol]
+        if castleRights != self.currentCastleRights:
+            key ^= Zobrist.CASTLE_KEYS[self.currentCastleRights] ^ Zobrist.CASTLE_KEYS[castleRights]
+            self.currentCastleRights = castleRights
+        self.zobristKey = key
+        self.moveLog.append(move)
+        self.whiteToMove = not self.whiteToMove
+        if DEBUG_ZOBRIST:
+            self.checkZobristKey()
+
+    '''
+    Undo the last move
+    '''
+    def undoMove(self):
+        if len(self.moveLog) == 0:
+            return
+        move = self.moveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        pieces = self.pieces
+        occupancy = self.occupancy
+        mailbox = self.mailbox
+        piece = move.pieceMoved
+        packed = move.packed
+        flags = packed >> FLAGS_SHIFT
+        startSq = packed & SQUARE_MASK
+        endSq = (packed >> 6) & SQUARE_MASK
+        color = piece[0]
+        enemyColor = 'b' if color == 'w' else 'w'
+        startBit = 1 << startSq
+        endBit = 1 << endSq
+
+        if flags == CASTLE_FLAG:
+            if move.endCol - move.startCol == 2:
+                rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+            else:
+                rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+            rook = color + 'R'
+            rowSq = move.endRow * 8
+            rookBits = (1 << (rowSq + rookFrom)) | (1 << (rowSq + rookTo))
+            pieces[rook] ^= rookBits
+            occupancy[color] ^= rookBits
+            mailbox[rowSq + rookFrom] = rook
+            mailbox[rowSq + rookTo] = '--'
+
+        occupancy[color] ^= startBit | endBit
+        if flags & PROMOTION_FLAG:
+            pieces[piece] ^= startBit
+            pieces[color + Move.promotionPieces[flags & 3]] ^= endBit
+        else:
+            pieces[piece] ^= startBit | endBit
+        mailbox[startSq] = piece
+
+        captured = move.pieceCaptured
+        if flags == ENPASSANT_FLAG:
+            capturedSq = startSq - move.startCol + move.endCol
+            pieces[captured] ^= 1 << capturedSq
+            occupancy[enemyColor] ^= 1 << capturedSq
+            mailbox[capturedSq] = captured
+            mailbox[endSq] = '--'
+        else:
+            if captured != '--':
+                pieces[captured] ^= endBit
+                occupancy[enemyColor] ^= endBit
+            mailbox[endSq] = captured
+        self.boardView = None
+
+        record = self.undoStack[len(self.moveLog)]
+        self.currentCastleRights = record[0]
+        self.enpassantPossible = record[1]
+        self.zobristKey = record[2]
+        self.halfmoveClock = record[3]
+        self.mgScore = record[4]
+        self.egScore = record[5]
+        self.phase = record[6]
+        if color == 'b':
+            self.fullmoveNumber -= 1
+        self.checkMate = False
+        self.staleMate = False
+        if DEBUG_ZOBRIST:
+            self.checkZobristKey()
+
+    '''
+    Bitboard of pieces of byColor attacking square sq, given the occupancy occupied
+    '''
+    def attackersTo(self, sq, byColor, occupied):
+        pieces = self.pieces
+        defender = 'b' if byColor == 'w' else 'w'
+        queens = pieces[byColor + 'Q']
+        attackers = (PAWN_ATTACKS[defender][sq] & pieces[byColor + 'p']) | \
+            (KNIGHT_ATTACKS[sq] & pieces[byColor + 'N']) | \
+            (KING_ATTACKS[sq] & pieces[byColor + 'K'])
+        # only trace the rays when a slider stands on one of the lines through sq
+        rooks = ROOK_RAYS[sq] & (pieces[byColor + 'R'] | queens)
+        if rooks:
+            attackers |= rookAttacks(sq, occupied) & rooks
+        bishops = BISHOP_RAYS[sq] & (pieces[byColor + 'B'] | queens)
+        if bishops:
+            attackers |= bishopAttacks(sq, occupied) & bishops
+        return attackers
+
+    '''
+    Determine if the enemy can attack the square at row, col
+    '''
+    def squareUnderAttack(self, row, col):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        return self.attackersTo(row * 8 + col, enemyColor, occupied) != 0
+
+    '''
+    Squares of the pieces of attackerColor (default: the side not to move) that attack row, col.
+    With firstOnly only one attacker is returned
+    '''
+    def getAttackers(self, row, col, attackerColor=None, firstOnly=False):
+        if attackerColor is None:
+            attackerColor = 'b' if self.whiteToMove else 'w'
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        attackers = self.attackersTo(row * 8 + col, attackerColor, occupied)
+        if firstOnly:
+            attackers &= -attackers
+        return [divmod(sq, 8) for sq in iterBits(attackers)]
+
+    '''
+    Find the checkers and pinned pieces of the side to move and set self.inCheck. Returns the king square, the
+    check mask (squares non-king moves may land on: everything, the checker and the squares between it and the
+    king, or nothing in double check) and the pin masks (pinned piece square -> squares along its pin line)
+    '''
+    def prepareLegality(self):
+        pieces = self.pieces
+        allyColor, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        kingSq = pieces[allyColor + 'K'].bit_length() - 1
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        checkers = self.attackersTo(kingSq, enemyColor, occupied)
+        self.inCheck = checkers != 0
+        if not checkers:
+            checkMask = ALL_SQUARES
+        elif checkers & (checkers - 1): # double check, only the king can move
+            checkMask = 0
+        else:
+            checkMask = checkers | BETWEEN_MASKS[kingSq][checkers.bit_length() - 1]
+        # an enemy slider on a line through the king pins the piece when that is the only piece in between
+        queens = pieces[enemyColor + 'Q']
+        snipers = (ROOK_RAYS[kingSq] & (pieces[enemyColor + 'R'] | queens)) | \
+            (BISHOP_RAYS[kingSq] & (pieces[enemyColor + 'B'] | queens))
+        own = self.occupancy[allyColor]
+        pinMasks = {}
+        for sq in iterBits(snipers):
+            between = BETWEEN_MASKS[kingSq][sq]
+            blockers = between & occupied
+            if blockers & own and not blockers & (blockers - 1):
+                pinMasks[blockers.bit_length() - 1] = between | (1 << sq)
+        return kingSq, checkMask, pinMasks
+
+    '''
+    All moves considering checks
+    '''
+    def getValidMovesAdvanced(self):
+        kingSq, checkMask, pinMasks = self.prepareLegality()
+        moves = self.addTargetMoves(ALL_SQUARES, kingSq, checkMask, pinMasks, [])
+        self.getCastleMoves(kingSq >> 3, kingSq & 7, moves)
+        self.checkMate = len(moves) == 0 and self.inCheck
+        self.staleMate = len(moves) == 0 and not self.inCheck
+        return moves
+
+    '''
+    Add the legal moves landing on targets (a square bitboard) to moves: king moves onto unattacked squares and
+    piece moves inside checkMask and their pin line. Pawn moves onto the promotion ranks are left out unless
+    promotions is set. kingSq, checkMask and pinMasks come from prepareLegality on this position
+    '''
+    def addTargetMoves(self, targets, kingSq, checkMask, pinMasks, moves, promotions=True):
+        pieces = self.pieces
+        mailbox = self.mailbox
+        newMove = Move.fromParts
+        allyColor, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        own = self.occupancy[allyColor]
+        enemy = self.occupancy[enemyColor]
+        occupied = own | enemy
+        king = allyColor + 'K'
+        withoutKing = occupied ^ (1 << kingSq) # so the king can't hide behind itself from a slider
+        for endSq in iterBits(KING_ATTACKS[kingSq] & targets & ~own):
+            if not self.attackersTo(endSq, enemyColor, withoutKing):
+                moves.append(newMove(kingSq | endSq << 6, king, mailbox[endSq]))
+        if not checkMask: # double check
+            return moves
+
+        allowed = checkMask & targets & ~own
+        pinned = 0
+        for sq in pinMasks:
+            pinned |= 1 << sq
+        knight = allyColor + 'N'
+        # the target loops below are iterBits written out, they run once per generated move
+        for sq in iterBits(pieces[knight] & ~pinned): # a pinned knight can never move
+            reach = KNIGHT_ATTACKS[sq] & allowed
+            while reach:
+                endBit = reach & -reach
+                endSq = endBit.bit_length() - 1
+                moves.append(newMove(sq | endSq << 6, knight, mailbox[endSq]))
+                reach ^= endBit
+        for piece, attacks in ((allyColor + 'B', bishopAttacks), (allyColor + 'R', rookAttacks),
+                               (allyColor + 'Q', queenAttacks)):
+            for sq in iterBits(pieces[piece]):
+                reach = attacks(sq, occupied) & allowed
+                if pinned & (1 << sq):
+                    reach &= pinMasks[sq]
+                while reach:
+                    endBit = reach & -reach
+                    endSq = endBit.bit_length() - 1
+                    moves.append(newMove(sq | endSq << 6, piece, mailbox[endSq]))
+                    reach ^= endBit
+
+        pawns = pieces[allyColor + 'p']
+        empty = ALL_SQUARES ^ occupied
+        pawnAllowed = allowed if promotions else allowed & ~PROMOTION_SQUARES
+        self.addPawnMoves(pawns & ~pinned, pawnAllowed, empty, enemy, moves)
+        for sq in iterBits(pawns & pinned):
+            self.addPawnMoves(1 << sq, pawnAllowed & pinMasks[sq], empty, enemy, moves)
+        if self.enpassantPossible != ():
+            self.addEnpassantMoves(targets, kingSq, checkMask, moves)
+        return moves
+
+    '''
+    Add the moves of the pawns in pawns that land on allowed: pushes onto empty squares and captures of enemy
+    pieces, with a promotion expanded into one move per promotion piece
+    '''
+    def addPawnMoves(self, pawns, allowed, empty, enemy, moves):
+        mailbox = self.mailbox
+        newMove = Move.fromParts
+        if self.whiteToMove:
+            pawn = 'wp'
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            # (end squares, start square - end square)
+            groups = ((single & allowed, 8), (double & allowed, 16),
+                      (((pawns & ~FILE_A) >> 9) & enemy & allowed, 9), (((pawns & ~FILE_H) >> 7) & enemy & allowed, 7))
+        else:
+            pawn = 'bp'
+            single = (pawns << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            groups = ((single & allowed, -8), (double & allowed, -16),
+                      (((pawns & ~FILE_A) << 7) & enemy & allowed, -7), (((pawns & ~FILE_H) << 9) & enemy & allowed, -9))
+        for ends, offset in groups:
+            while ends:
+                endBit = ends & -ends
+                endSq = endBit.bit_length() - 1
+                packed = (endSq + offset) | endSq << 6
+                if endBit & PROMOTION_SQUARES:
+                    for code in PROMOTION_CODES:
+                        moves.append(newMove(packed | code, pawn, mailbox[endSq]))
+                else:
+                    moves.append(newMove(packed, pawn, mailbox[endSq]))
+                ends ^= endBit
+
+    '''
+    Add the legal en passant captures when the captured pawn's square is in targets. Taking two pawns off one rank
+    can uncover a slider, so the king is tested against the sliders on the board as it would be after the capture
+    '''
+    def addEnpassantMoves(self, targets, kingSq, checkMask, moves):
+        epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        allyColor, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        capturedSq = epSq + 8 if self.whiteToMove else epSq - 8
+        capturedBit = 1 << capturedSq
+        epBit = 1 << epSq
+        # in check, the capture has to take the checking pawn or block on the en passant square
+        if not targets & capturedBit or not checkMask & (epBit | capturedBit):
+            return
+        pieces = self.pieces
+        queens = pieces[enemyColor + 'Q']
+        rooks = pieces[enemyColor + 'R'] | queens
+        bishops = pieces[enemyColor + 'B'] | queens
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        pawn = allyColor + 'p'
+        for sq in iterBits(PAWN_ATTACKS[enemyColor][epSq] & pieces[pawn]):
+            after = (occupied ^ (1 << sq) ^ capturedBit) | epBit
+            if not rookAttacks(kingSq, after) & rooks and not bishopAttacks(kingSq, after) & bishops:
+                moves.append(Move.fromParts(sq | epSq << 6 | ENPASSANT_FLAG << FLAGS_SHIFT, pawn, enemyColor + 'p'))
+
+    '''
+    Non-capturing pawn moves onto the promotion rank
+    '''
+    def addQuietPromotions(self, empty, checkMask, pinMasks, moves):
+        allowed = checkMask & empty & PROMOTION_SQUARES
+        if not allowed:
+            return moves
+        pawns = self.pieces['wp' if self.whiteToMove else 'bp']
+        pinned = 0
+        for sq in pinMasks:
+            pinned |= 1 << sq
+        self.addPawnMoves(pawns & ~pinned, allowed, empty, 0, moves)
+        for sq in iterBits(pawns & pinned):
+            self.addPawnMoves(1 << sq, allowed & pinMasks[sq], empty, 0, moves)
+        return moves
+
+    '''
+    Legal moves in the order a search wants to try them, one stage at a time, like ChessEngine's
+    generateMovesStaged: the hash move (a packed move, 0 for none), captures by MVV-LVA, quiet promotions, then
+    quiet moves and castles. Sets self.inCheck on the first move asked for. Moves may be made and undone between
+    items as long as the position is back when the next one is asked for
+    '''
+    def generateMovesStaged(self, hashMove=0):
+        kingSq, checkMask, pinMasks = self.prepareLegality()
+        inCheck = self.inCheck
+
+        if hashMove:
+            candidates = [] # the legal moves that could be the hash move
+            flags = hashMove >> FLAGS_SHIFT
+            if flags == CASTLE_FLAG:
+                if hashMove & SQUARE_MASK == kingSq:
+                    self.getCastleMoves(kingSq >> 3, kingSq & 7, candidates)
+            elif flags == ENPASSANT_FLAG:
+                if self.enpassantPossible != ():
+                    self.addEnpassantMoves(ALL_SQUARES, kingSq, checkMask, candidates)
+            else:
+                self.addTargetMoves(1 << ((hashMove >> 6) & SQUARE_MASK), kingSq, checkMask, pinMasks, candidates)
+            for move in candidates:
+                if move.packed == hashMove:
+                    yield move
+                    break
+            else:
+                hashMove = 0 # not legal here, so nothing to skip later
+
+        enemy = self.occupancy['b' if self.whiteToMove else 'w']
+        moves = self.addTargetMoves(enemy, kingSq, checkMask, pinMasks, [])
+        moves.sort(key=Evaluation.mvvLva, reverse=True)
+        for move in moves:
+            if move.packed != hashMove:
+                yield move
+
+        empty = ALL_SQUARES ^ (self.occupancy['w'] | self.occupancy['b'])
+        for move in self.addQuietPromotions(empty, checkMask, pinMasks, []):
+            if move.packed != hashMove:
+                yield move
+
+        moves = self.addTargetMoves(empty, kingSq, checkMask, pinMasks, [], promotions=False)
+        self.inCheck = inCheck
+        self.getCastleMoves(kingSq >> 3, kingSq & 7, moves)
+        for move in moves:
+            if move.packed != hashMove:
+                yield move
+
+    '''
+    Legal captures and promotions, best captures first by MVV-LVA, for quiescence search and tactical scans.
+    Sets self.inCheck; in check the caller usually wants every evasion from generateMovesStaged instead
+    '''
+    def getCaptureMoves(self):
+        kingSq, checkMask, pinMasks = self.prepareLegality()
+        enemy = self.occupancy['b' if self.whiteToMove else 'w']
+        empty = ALL_SQUARES ^ (self.occupancy['w'] | self.occupancy['b'])
+        moves = self.addTargetMoves(enemy, kingSq, checkMask, pinMasks, [])
+        moves.sort(key=Evaluation.mvvLva, reverse=True)
+        return self.addQuietPromotions(empty, checkMask, pinMasks, moves)
+
+    '''
+    Legal moves that give check, for tactical scans. Sets self.inCheck, self.checkMate and self.staleMate like
+    getValidMovesAdvanced
+    '''
+    def getCheckingMoves(self):
+        moves = self.getValidMovesAdvanced()
+        flags = (self.inCheck, self.checkMate, self.staleMate)
+        moves = [move for move in moves if self.givesCheck(move)]
+        self.inCheck, self.checkMate, self.staleMate = flags
+        return moves
+
+    '''
+    Whether a legal move puts the opponent in check, directly or by discovery
+    '''
+    def givesCheck(self, move):
+        self.makeMove(move)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        check = self.squareUnderAttack(kingRow, kingCol)
+        self.undoMove()
+        return check
+
+    '''
+    Count the leaf nodes of the legal move tree to the given depth
+    '''
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        moves = self.getValidMovesAdvanced()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.undoMove()
+        return nodes
+
+    '''
+    Perft split by root move. Returns a dict of move notation to node count
+    '''
+    def divide(self, depth):
+        counts = {}
+        for move in self.getValidMovesAdvanced():
+            self.makeMove(move)
+            counts[move.getChessNotation()] = self.perft(depth - 1)
+            self.undoMove()
+        return counts
+
+    '''
+    All moves ignoring checks and pins. The king still only steps onto unattacked squares
+    '''
+    def getAllPossibleMoves(self):
+        kingSq = self.pieces['wK' if self.whiteToMove else 'bK'].bit_length() - 1
+        return self.addTargetMoves(ALL_SQUARES, kingSq, ALL_SQUARES, {}, [])
+
+    def getCastleMoves(self, row, col, moves):
+        if self.inCheck:
+            return
+        if self.currentCastleRights & (WKS if self.whiteToMove else BKS):
+            self.getKingSideCastleMoves(row, col, moves)
+        if self.currentCastleRights & (WQS if self.whiteToMove else BQS):
+            self.getQueenSideCastleMoves(row, col, moves)
+
+    def getKingSideCastleMoves(self, row, col, moves):
+        kingSq = row * 8 + col
+        if not (self.occupancy['w'] | self.occupancy['b']) & (3 << (kingSq + 1)):
+            if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
+                moves.append(Move.fromParts(kingSq | (kingSq + 2) << 6 | CASTLE_FLAG << FLAGS_SHIFT,
+                                            self.mailbox[kingSq], '--'))
+
+    def getQueenSideCastleMoves(self, row, col, moves):
+        kingSq = row * 8 + col
+        if not (self.occupancy['w'] | self.occupancy['b']) & (7 << (kingSq - 3)):
+            if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
+                moves.append(Move.fromParts(kingSq | (kingSq - 2) << 6 | CASTLE_FLAG << FLAGS_SHIFT,
+                                            self.mailbox[kingSq], '--'))
@@ -1,10 +1,50 @@
+'''Castle rights packed into a 4-bit integer, one bit per right'''
 
-class CastleRights():
-    def __init__(self, wks, wqs, bks, bqs):
-        self.wks = wks
-        self.wqs = wqs
-        self.bks = bks
-        self.bqs = bqs
-    
-    def __str__(self) -> str:
-        return f"{self.wks}, {self.wqs}, {self.bks}, {self.bqs}"
+WKS = 1
+WQS = 2
+BKS = 4
+BQS = 8
+ALL_RIGHTS = WKS | WQS | BKS | BQS
+NO_RIGHTS = 0
+
+# rights that survive a piece moving from or to each square, indexed [row][col].
+# a move keeps currentCastleRights & CASTLE_MASKS[start] & CASTLE_MASKS[end], which covers king moves,
+# rook moves and rooks captured on their home squares with one lookup each
+CASTLE_MASKS = [[ALL_RIGHTS] * 8 for row in range(8)]
+CASTLE_MASKS[7][4] = ALL_RIGHTS & ~(WKS | WQS)
+CASTLE_MASKS[7][0] = ALL_RIGHTS & ~WQS
+CASTLE_MASKS[7][7] = ALL_RIGHTS & ~WKS
+CASTLE_MASKS[0][4] = ALL_RIGHTS & ~(BKS | BQS)
+CASTLE_MASKS[0][0] = ALL_RIGHTS & ~BQS
+CASTLE_MASKS[0][7] = ALL_RIGHTS & ~BKS
+
+'''
+Castle rights in FEN notation, e.g. "KQkq" or "-"
+'''
+def castleRightsToString(rights):
+    text = ''.join(char for bit, char in ((WKS, 'K'), (WQS, 'Q'), (BKS, 'k'), (BQS, 'q')) if rights & bit)
+    return text or '-'
+
+'''
+Castle rights from FEN notation
+'''
+def castleRightsFromString(text):
+    rights = NO_RIGHTS
+    for bit, char in ((WKS, 'K'), (WQS, 'Q'), (BKS, 'k'), (BQS, 'q')):
+        if char in text:
+            rights |= bit
+    return rights
+
+# castle right -> (king square, rook square) that must still hold their pieces
+HOME_SQUARES = {WKS: ((7, 4, 'wK'), (7, 7, 'wR')), WQS: ((7, 4, 'wK'), (7, 0, 'wR')),
+                BKS: ((0, 4, 'bK'), (0, 7, 'bR')), BQS: ((0, 4, 'bK'), (0, 0, 'bR'))}
+
+'''
+The rights whose king and rook are on their home squares. Any other right, e.g. from a hand-written FEN, would
+let the king castle with a rook that isn't there
+'''
+def castleRightsOnBoard(board, rights):
+    for bit, squares in HOME_SQUARES.items():
+        if rights & bit and any(board[row][col] != piece for row, col, piece in squares):
+            rights &= ~bit
+    return rights
@@ -1,10 +1,25 @@
-from Move import Move
-from CastleRights import CastleRights 
+from Move import Move, SQUARE_MASK, FLAGS_SHIFT, CASTLE_FLAG, ENPASSANT_FLAG, PROMOTION_FLAG
+from CastleRights import ALL_RIGHTS, NO_RIGHTS, WKS, WQS, BKS, BQS, CASTLE_MASKS, castleRightsOnBoard
+import Zobrist
+import Evaluation
+import Fen
+from DrawRules import DrawRules
+from AttackTables import SQUARES, SQUARE_BITS, ALL_SQUARES, DIRECTIONS, DIRECTION_INDEX, RAYS, RAY_MASKS, \
+    KNIGHT_SQUARES, KING_SQUARES, PAWN_ATTACK_SQUARES
+
+# when True, makeMove/undoMove recompute the zobrist key from scratch and assert it matches the incremental key
+DEBUG_ZOBRIST = False
+# undo records preallocated per GameState. the stack doubles if a game runs longer
+UNDO_STACK_SIZE = 512
+# pieces of each color in the order their moves are generated
+COLOR_PIECES = {'w': ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK'), 'b': ('bp', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+# squares on the first and last rank, where pawn moves promote
+PROMOTION_SQUARES = sum(SQUARE_BITS[0]) | sum(SQUARE_BITS[7])
 
 '''This class is responsible or storing all the information about the current state of a chess game. 
 It is also responsible for determining the valid moves at the current state, and will maintain a move log'''
 
-class GameState():
+class GameState(DrawRules):
     def __init__(self):
         # board is an 8x8 2d list. 
         # First char represents color, and second char represents type
@@ -19,23 +34,121 @@ class GameState():
             ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
             ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
         ]
-        self.moveFunctions = {
-            "p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves, "B": self.getBishopMoves,
-            "Q": self.getQueenMoves, "K": self.getKingMoves
-        }
+        self.bindMoveFunctions()
         self.whiteToMove = True
         self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+        self.whiteKingLocation = SQUARES[7][4]
+        self.blackKingLocation = SQUARES[0][4]
         self.checkMate = False
         self.staleMate = False
         self.inCheck = False
         self.pins = []
         self.checks = []
+        # squares non-king moves may land on: everything, the check-blocking squares, or nothing in double check
+        self.checkMask = ALL_SQUARES
+        # pinned piece square -> squares along its pin line
+        self.pinMasks = {}
+        # squares the king may step to before its attack test: everything, or the capture or quiet squares of a stage
+        self.kingMask = ALL_SQUARES
         self.enpassantPossible = () # coordinates of square where possible. only 1 square on each move
-        self.currentCastleRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.wqs,
-                                self.currentCastleRights.bks, self.currentCastleRights.wqs)]    
+        self.currentCastleRights = ALL_RIGHTS # 4-bit WKS | WQS | BKS | BQS
+        self.halfmoveClock = 0 # plies since the last capture or pawn move
+        self.fullmoveNumber = 1 # starts at 1 and goes up after each black move
+        self.zobristKey = self.computeZobristKey()
+        self.loadPieceSquares()
+        # incrementally maintained middlegame and endgame scores (white's point of view) and game phase
+        self.mgScore, self.egScore, self.phase = Evaluation.computeScores(self.board)
+        # one [castle rights, en passant square, zobrist key, halfmove clock, mg score, eg score, phase] record per
+        # ply, reused in place by makeMove
+        self.undoStack = [[NO_RIGHTS, (), 0, 0, 0, 0, 0] for i in range(UNDO_STACK_SIZE)]
+
+    '''
+    Map piece letters to this GameState's move generators. Called again when the generator methods are replaced
+    on the class, e.g. by Instrumentation, since the dict holds bound methods
+    '''
+    def bindMoveFunctions(self):
+        self.moveFunctions = {
+            "p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves, "B": self.getBishopMoves,
+            "Q": self.getQueenMoves, "K": self.getKingMoves
+        }
+
+    '''
+    Rebuild the per-piece square sets from the board. makeMove/undoMove keep them up to date after this
+    '''
+    def loadPieceSquares(self):
+        # piece -> set of (row, col) squares it stands on
+        self.pieceSquares = {piece: set() for color in COLOR_PIECES for piece in COLOR_PIECES[color]}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != '--':
+                    self.pieceSquares[piece].add(SQUARES[row][col])
+
+    '''
+    Number of pieces of both colors on the board, kings included
+    '''
+    def pieceCount(self):
+        return sum(map(len, self.pieceSquares.values()))
+
+    '''
+    Zobrist key of the current position computed from scratch
+    '''
+    def computeZobristKey(self):
+        return Zobrist.computeKey(self.board, self.whiteToMove, self.currentCastleRights, self.enpassantPossible)
+
+    '''
+    Debug check that the incrementally maintained zobrist key matches a full recompute
+    '''
+    def checkZobristKey(self):
+        assert self.zobristKey == self.computeZobristKey(), "incremental zobrist key out of sync with the board"
+        assert (self.mgScore, self.egScore, self.phase) == Evaluation.computeScores(self.board), \
+            "incremental evaluation out of sync with the board"
+
+    '''
+    New GameState set up from a FEN string
+    '''
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls()
+        gs.setFen(fen)
+        return gs
+
+    '''
+    Replace the current position with the one described by a FEN string. The move log is cleared
+    '''
+    def setFen(self, fen):
+        self.setPosition(*Fen.parseFen(fen))
+
+    '''
+    Replace the current position with the given board (a list of 8 rows) and state. The move log is cleared
+    '''
+    def setPosition(self, board, whiteToMove, castleRights=NO_RIGHTS, enpassantPossible=(), halfmoveClock=0,
+                    fullmoveNumber=1):
+        # validate everything before the first field changes, so a bad position leaves the old one intact
+        Fen.checkBoard(board)
+        enpassantPossible = Fen.capturableEnpassant(board, whiteToMove, enpassantPossible)
+        self.board[:] = board
+        self.whiteToMove = whiteToMove
+        self.currentCastleRights = castleRightsOnBoard(board, castleRights)
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.loadPieceSquares()
+        self.whiteKingLocation = next(iter(self.pieceSquares['wK']))
+        self.blackKingLocation = next(iter(self.pieceSquares['bK']))
+        self.zobristKey = self.computeZobristKey()
+        self.mgScore, self.egScore, self.phase = Evaluation.computeScores(self.board)
+
+    '''
+    FEN string of the current position
+    '''
+    def toFen(self):
+        return Fen.formatFen(self.board, self.whiteToMove, self.currentCastleRights, self.enpassantPossible,
+                             self.halfmoveClock, self.fullmoveNumber)
+
     '''
     returns checks, pins and whether currently in check
     '''
@@ -53,152 +166,233 @@ class GameState():
             allyColor = 'b'
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        directions = ((-1, 0), (0,-1), (1,0), (0,1), (-1, -1), (-1, 1),(1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
+        board = self.board
+        rays = RAYS[startRow][startCol]
+        for j in range(8):
+            d = DIRECTIONS[j]
             possiblePin = ()
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol <8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
+            i = 0
+            for endRow, endCol in rays[j]:
+                i += 1
+                endPiece = board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin == ():
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    #second allied piece, so no pin or check possible in this direction
+                    else:
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    # 5 possiblities here to check for
+                    # 1. orthogonally away from king and piece is a rook
+                    # 2. diagonally away form king and piece is a bishop
+                    # 3. 1 square diagonally away from king and piece is a pawn
+                    # 4. any direction and piece is a queen
+                    # 5. any direction 1 square away and piece is a king
+                    if (0 <= j <= 3 and type == 'R') or \
+                        (4 <= j <= 7 and type == 'B') or \
+                            (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor =='b' and 4 <= j <= 5))) or \
+                                (type == 'Q') or (i == 1 and type == 'K'):
                         if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        #second allied piece, so no pin or check possible in this direction
-                        else:
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # 5 possiblities here to check for
-                        # 1. orthogonally away from king and piece is a rook
-                        # 2. diagonally away form king and piece is a bishop
-                        # 3. 1 square diagonally away from king and piece is a pawn
-                        # 4. any direction and piece is a queen
-                        # 5. any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and type == 'R') or \
-                            (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor =='b' and 4 <= j <= 5))) or \
-                                    (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePin == ():
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblePin)
-                                break
                         else:
-                            # piece not applying check
+                            pins.append(possiblePin)
                             break
-                else: 
-                    break # off board
+                    else:
+                        # piece not applying check
+                        break
         
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m [0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        enemyKnight = enemyColor + 'N'
+        for endRow, endCol in KNIGHT_SQUARES[startRow][startCol]:
+            if board[endRow][endCol] == enemyKnight:
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         return inCheck, pins, checks
 
     '''
-    Takes a move and executes it. Will not work for castling, pawn promotion and en-passant
+    Takes a move and executes it, including castling, pawn promotion and en-passant.
+    State needed to undo it is written into a preallocated undo record, so the hot path allocates nothing
     '''
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        board = self.board
+        startRow, startCol, endRow, endCol = move.startRow, move.startCol, move.endRow, move.endCol
+        flags = move.packed >> FLAGS_SHIFT
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.extend([NO_RIGHTS, (), 0, 0, 0, 0, 0] for i in range(ply))
+        record = self.undoStack[ply]
+        record[0] = self.currentCastleRights
+        record[1] = self.enpassantPossible
+        record[2] = self.zobristKey
+        record[3] = self.halfmoveClock
+        record[4] = self.mgScore
+        record[5] = self.egScore
+        record[6] = self.phase
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
+
+        # xor in only the features this move changes
+        pieceKeys = Zobrist.PIECE_KEYS
+        key = self.zobristKey ^ Zobrist.BLACK_TO_MOVE_KEY ^ pieceKeys[move.pieceMoved][startRow][startCol]
+        if flags & PROMOTION_FLAG:
+            key ^= pieceKeys[move.pieceMoved[0] + Move.promotionPieces[flags & 3]][endRow][endCol]
+        else:
+            key ^= pieceKeys[move.pieceMoved][endRow][endCol]
+        if flags == ENPASSANT_FLAG:
+            key ^= pieceKeys[move.pieceCaptured][startRow][endCol]
+        elif move.pieceCaptured != '--':
+            key ^= pieceKeys[move.pieceCaptured][endRow][endCol]
+        if self.enpassantPossible != ():
+            key ^= Zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+
+        # and add in only the evaluation terms it changes
+        mgTables, egTables = Evaluation.MG_TABLES, Evaluation.EG_TABLES
+        mgScore = self.mgScore - mgTables[move.pieceMoved][startRow][startCol]
+        egScore = self.egScore - egTables[move.pieceMoved][startRow][startCol]
+        if flags & PROMOTION_FLAG:
+            promoted = move.pieceMoved[0] + Move.promotionPieces[flags & 3]
+            mgScore += mgTables[promoted][endRow][endCol]
+            egScore += egTables[promoted][endRow][endCol]
+            self.phase += Evaluation.PHASES[promoted]
+        else:
+            mgScore += mgTables[move.pieceMoved][endRow][endCol]
+            egScore += egTables[move.pieceMoved][endRow][endCol]
+        if flags == ENPASSANT_FLAG:
+            mgScore -= mgTables[move.pieceCaptured][startRow][endCol]
+            egScore -= egTables[move.pieceCaptured][startRow][endCol]
+        elif move.pieceCaptured != '--':
+            mgScore -= mgTables[move.pieceCaptured][endRow][endCol]
+            egScore -= egTables[move.pieceCaptured][endRow][endCol]
+            self.phase -= Evaluation.PHASES[move.pieceCaptured]
+
+        # keep the piece square sets in step with the board
+        pieceSquares = self.pieceSquares
+        pieceSquares[move.pieceMoved].remove(SQUARES[startRow][startCol])
+        if flags == ENPASSANT_FLAG:
+            pieceSquares[move.pieceCaptured].remove(SQUARES[startRow][endCol])
+        elif move.pieceCaptured != '--':
+            pieceSquares[move.pieceCaptured].remove(SQUARES[endRow][endCol])
+        if flags & PROMOTION_FLAG:
+            pieceSquares[move.pieceMoved[0] + Move.promotionPieces[flags & 3]].add(SQUARES[endRow][endCol])
+        else:
+            pieceSquares[move.pieceMoved].add(SQUARES[endRow][endCol])
+
+        board[startRow][startCol] = '--'
+        board[endRow][endCol] = move.pieceMoved
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove
         if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        if move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
-        
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.whiteKingLocation = SQUARES[endRow][endCol]
+        elif move.pieceMoved == 'bK':
+            self.blackKingLocation = SQUARES[endRow][endCol]
         
+        if flags & PROMOTION_FLAG:
+            board[endRow][endCol] = move.pieceMoved[0] + Move.promotionPieces[flags & 3]
 
         # set enPassant square
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.endCol)
+        if move.pieceMoved[1] == 'p' and abs(startRow - endRow) == 2:
+            self.enpassantPossible = Fen.capturableEnpassant(board, self.whiteToMove,
+                                                             SQUARES[(startRow + endRow) // 2][endCol])
+            if self.enpassantPossible != ():
+                key ^= Zobrist.ENPASSANT_KEYS[endCol]
         else:
             self.enpassantPossible = ()
-        if move.isEnpassant:
+        if flags == ENPASSANT_FLAG:
             # capturing the pawn beside it, and after move behind it
-            self.board[move.startRow][move.endCol] = '--' 
+            board[startRow][endCol] = '--' 
 
         # castle move
-        if move.isCastle:
-            if move.endCol - move.startCol == 2: # kingside castle
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol + 1] ="--" # erase old rook
+        if flags == CASTLE_FLAG:
+            rook = move.pieceMoved[0] + 'R'
+            if endCol - startCol == 2: # kingside castle
+                rookFrom, rookTo = endCol + 1, endCol - 1
             else: # queenside castle
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol-2]
-                self.board[move.endRow][move.endCol - 2] ="--" # erase old rook
-                
+                rookFrom, rookTo = endCol - 2, endCol + 1
+            board[endRow][rookTo] = rook
+            board[endRow][rookFrom] = "--" # erase old rook
+            key ^= pieceKeys[rook][endRow][rookFrom] ^ pieceKeys[rook][endRow][rookTo]
+            mgScore += mgTables[rook][endRow][rookTo] - mgTables[rook][endRow][rookFrom]
+            egScore += egTables[rook][endRow][rookTo] - egTables[rook][endRow][rookFrom]
+            pieceSquares[rook].remove(SQUARES[endRow][rookFrom])
+            pieceSquares[rook].add(SQUARES[endRow][rookTo])
+        self.mgScore = mgScore
+        self.egScore = egScore
+
+        # update castle rights: moving from or to a king or rook home square drops the matching rights
+        castleRights = self.currentCastleRights & CASTLE_MASKS[startRow][startCol] & CASTLE_MASKS[endRow][endCol]
+        if castleRights != self.currentCastleRights:
+            key ^= Zobrist.CASTLE_KEYS[self.currentCastleRights] ^ Zobrist.CASTLE_KEYS[castleRights]
+            self.currentCastleRights = castleRights
+        self.zobristKey = key
+        if DEBUG_ZOBRIST:
+            self.checkZobristKey()
 
-        # update castle rights
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastleRights.wks, self.currentCastleRights.wqs,
-                                    self.currentCastleRights.bks, self.currentCastleRights.bqs))
     '''
     Undo the last move
     '''
     def undoMove(self):
-        if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
-            self.whiteToMove = not self.whiteToMove
+        if len(self.moveLog) == 0:
+            return
+        board = self.board
+        move = self.moveLog.pop()
+        flags = move.packed >> FLAGS_SHIFT
+        startRow, startCol, endRow, endCol = move.startRow, move.startCol, move.endRow, move.endCol
+        board[startRow][startCol] = move.pieceMoved
+        board[endRow][endCol] = move.pieceCaptured
+        self.whiteToMove = not self.whiteToMove
         if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.startRow, move.startCol)
-        if move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.startRow, move.startCol)
-        
-        if move.isEnpassant:
-            self.board[move.endRow][move.endCol] = '--'
-            self.board[move.startRow][move.endCol] = move.pieceCaptured
-            self.enpassantPossible = (move.endRow, move.endCol)
-        
-        # case 2 square pawn move
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ()
+            self.whiteKingLocation = SQUARES[startRow][startCol]
+        elif move.pieceMoved == 'bK':
+            self.blackKingLocation = SQUARES[startRow][startCol]
         
-        # undo castle rights log
-        self.castleRightsLog.pop()
-        self.currentCastleRights = self.castleRightsLog[-1]
+        if flags == ENPASSANT_FLAG:
+            board[endRow][endCol] = '--'
+            board[startRow][endCol] = move.pieceCaptured
 
         # undo castle move
-        if move.isCastle:
-            if move.endCol - move.startCol == 2: # kingside
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
-                self.board[move.endRow][move.endCol - 1] = "--"
+        pieceSquares = self.pieceSquares
+        if flags == CASTLE_FLAG:
+            rook = move.pieceMoved[0] + 'R'
+            if endCol - startCol == 2: # kingside
+                rookFrom, rookTo = endCol + 1, endCol - 1
             else:
-                self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol + 1] = "--" 
+                rookFrom, rookTo = endCol - 2, endCol + 1
+            board[endRow][rookFrom] = rook
+            board[endRow][rookTo] = "--"
+            pieceSquares[rook].remove(SQUARES[endRow][rookTo])
+            pieceSquares[rook].add(SQUARES[endRow][rookFrom])
 
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastleRights.wks = False
-            self.currentCastleRights.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastleRights.bks = False
-            self.currentCastleRights.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastleRights.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastleRights.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastleRights.bqs = False
-                elif move.startCol == 7:
-                    self.currentCastleRights.bks = False
+        if flags & PROMOTION_FLAG:
+            pieceSquares[move.pieceMoved[0] + Move.promotionPieces[flags & 3]].remove(SQUARES[endRow][endCol])
+        else:
+            pieceSquares[move.pieceMoved].remove(SQUARES[endRow][endCol])
+        pieceSquares[move.pieceMoved].add(SQUARES[startRow][startCol])
+        if flags == ENPASSANT_FLAG:
+            pieceSquares[move.pieceCaptured].add(SQUARES[startRow][endCol])
+        elif move.pieceCaptured != '--':
+            pieceSquares[move.pieceCaptured].add(SQUARES[endRow][endCol])
+
+        # restore castle rights, en passant square, zobrist key, clock and evaluation from the undo record
+        record = self.undoStack[len(self.moveLog)]
+        self.currentCastleRights = record[0]
+        self.enpassantPossible = record[1]
+        self.zobristKey = record[2]
+        self.halfmoveClock = record[3]
+        self.mgScore = record[4]
+        self.egScore = record[5]
+        self.phase = record[6]
+        if move.pieceMoved[0] == 'b':
+            self.fullmoveNumber -= 1
+        self.checkMate = False
+        self.staleMate = False
+        if DEBUG_ZOBRIST:
+            self.checkZobristKey()
 
     '''
     All moves considering checks (naive brute force method)
@@ -242,34 +436,15 @@ class GameState():
         else:
             kingRow = self.blackKingLocation[0]
             kingCol = self.blackKingLocation[1]
-        if self.inCheck:
-            if(len(self.checks)) == 1: # only 1 check, block or move king
-                moves = self.getAllPossibleMoves()
-                # move a piece between enemy piece and king
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = [] #squares that pieces can move to 
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) # check 2 and 3 are the directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-                # remove moves that dont move king or block checks
-                for i in range(len(moves) -1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else: # double check, so king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
-        else: # not in check, so all moves fine
-            moves = self.getAllPossibleMoves()
+        self.computeLegalityMasks(kingRow, kingCol)
+        if len(self.checks) > 1: # double check, so king has to move
+            self.getKingMoves(kingRow, kingCol, moves)
+        else: # pieces only land on checkMask and their pin line, the king checks its own target squares
+            self.getPieceMoves(moves)
         
         self.getCastleMoves(kingRow, kingCol, moves)
+        self.checkMate = False
+        self.staleMate = False
         if len(moves) == 0:
             if self.inCheck:
                 self.checkMate = True
@@ -278,6 +453,195 @@ class GameState():
         
         return moves
 
+    '''
+    Find checks and pins and set up the legality masks for the side to move. Returns the king's square
+    '''
+    def prepareLegality(self):
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.computeLegalityMasks(kingRow, kingCol)
+        return kingRow, kingCol
+
+    '''
+    Bitboard of the squares occupied by color's pieces
+    '''
+    def occupancyBits(self, color):
+        bits = 0
+        pieceSquares = self.pieceSquares
+        for piece in COLOR_PIECES[color]:
+            for row, col in pieceSquares[piece]:
+                bits |= SQUARE_BITS[row][col]
+        return bits
+
+    '''
+    Add the legal moves landing on targets (a square bitboard) to moves: piece moves inside checkMask & targets
+    and king moves onto targets. Pawn moves onto the promotion ranks are left out unless promotions is set.
+    The pin masks must be the ones of this position
+    '''
+    def addTargetMoves(self, targets, checkMask, doubleCheck, kingRow, kingCol, moves, promotions=True):
+        self.kingMask = targets
+        if doubleCheck: # king has to move
+            self.getKingMoves(kingRow, kingCol, moves)
+            return moves
+        pawnMask = checkMask & targets if promotions else checkMask & targets & ~PROMOTION_SQUARES
+        pieceSquares = self.pieceSquares
+        for piece in COLOR_PIECES['w' if self.whiteToMove else 'b']:
+            self.checkMask = pawnMask if piece[1] == 'p' else checkMask & targets
+            moveFunction = self.moveFunctions[piece[1]]
+            for row, col in pieceSquares[piece]:
+                moveFunction(row, col, moves)
+        return moves
+
+    '''
+    Non-capturing pawn moves onto the promotion rank
+    '''
+    def addQuietPromotions(self, emptyBits, checkMask, doubleCheck, moves):
+        if doubleCheck:
+            return moves
+        self.checkMask = checkMask & emptyBits & PROMOTION_SQUARES
+        fromRow = 1 if self.whiteToMove else 6
+        for row, col in self.pieceSquares['wp' if self.whiteToMove else 'bp']:
+            if row == fromRow:
+                self.getPawnMoves(row, col, moves)
+        return moves
+
+    '''
+    Legal moves in the order a search wants to try them, one stage at a time, so a cutoff on an early move skips
+    building the rest: the hash move (a packed move, 0 for none), captures by MVV-LVA, quiet promotions, then quiet
+    moves and castles. Sets self.inCheck on the first move asked for; it can't tell checkmate from stalemate up
+    front, so a caller that gets no moves looks at self.inCheck. Moves may be made and undone between items as long
+    as the position is back when the next one is asked for
+    '''
+    def generateMovesStaged(self, hashMove=0):
+        kingRow, kingCol = self.prepareLegality()
+        inCheck, checkMask, pinMasks = self.inCheck, self.checkMask, self.pinMasks
+        doubleCheck = len(self.checks) > 1
+        allyColor = 'w' if self.whiteToMove else 'b'
+        enemyBits = self.occupancyBits('b' if self.whiteToMove else 'w')
+        emptyBits = ALL_SQUARES & ~(enemyBits | self.occupancyBits(allyColor))
+
+        if hashMove:
+            startRow, startCol = divmod(hashMove & SQUARE_MASK, 8)
+            piece = self.board[startRow][startCol]
+            candidates = [] # the legal moves of the hash move's piece
+            if piece[0] == allyColor and (not doubleCheck or piece[1] == 'K'):
+                if hashMove >> FLAGS_SHIFT != CASTLE_FLAG:
+                    self.moveFunctions[piece[1]](startRow, startCol, candidates)
+                elif piece[1] == 'K':
+                    self.getCastleMoves(startRow, startCol, candidates)
+            for move in candidates:
+                if move.packed == hashMove:
+                    yield move
+                    break
+            else:
+                hashMove = 0 # not legal here, so nothing to skip later
+
+        # the caller's moves in between overwrite the masks, so each stage puts them back first
+        self.pinMasks = pinMasks
+        moves = self.addTargetMoves(enemyBits, checkMask, doubleCheck, kingRow, kingCol, [])
+        moves.sort(key=Evaluation.mvvLva, reverse=True)
+        for move in moves:
+            if move.packed != hashMove:
+                yield move
+
+        self.pinMasks = pinMasks
+        for move in self.addQuietPromotions(emptyBits, checkMask, doubleCheck, []):
+            if move.packed != hashMove:
+                yield move
+
+        self.pinMasks = pinMasks
+        moves = self.addTargetMoves(emptyBits, checkMask, doubleCheck, kingRow, kingCol, [], promotions=False)
+        self.inCheck = inCheck
+        self.getCastleMoves(kingRow, kingCol, moves)
+        for move in moves:
+            if move.packed != hashMove:
+                yield move
+
+    '''
+    Legal captures and promotions, best captures first by MVV-LVA, for quiescence search and tactical scans.
+    Sets self.inCheck; in check the caller usually wants every evasion from generateMovesStaged instead
+    '''
+    def getCaptureMoves(self):
+        kingRow, kingCol = self.prepareLegality()
+        checkMask = self.checkMask
+        doubleCheck = len(self.checks) > 1
+        enemyBits = self.occupancyBits('b' if self.whiteToMove else 'w')
+        emptyBits = ALL_SQUARES & ~(enemyBits | self.occupancyBits('w' if self.whiteToMove else 'b'))
+        moves = self.addTargetMoves(enemyBits, checkMask, doubleCheck, kingRow, kingCol, [])
+        moves.sort(key=Evaluation.mvvLva, reverse=True)
+        return self.addQuietPromotions(emptyBits, checkMask, doubleCheck, moves)
+
+    '''
+    Legal moves that give check, for tactical scans. Sets self.inCheck, self.checkMate and self.staleMate like
+    getValidMovesAdvanced
+    '''
+    def getCheckingMoves(self):
+        moves = self.getValidMovesAdvanced()
+        flags = (self.inCheck, self.checkMate, self.staleMate)
+        moves = [move for move in moves if self.givesCheck(move)]
+        self.inCheck, self.checkMate, self.staleMate = flags
+        return moves
+
+    '''
+    Whether a legal move puts the opponent in check, directly or by discovery
+    '''
+    def givesCheck(self, move):
+        self.makeMove(move)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        check = self.squareUnderAttack(kingRow, kingCol)
+        self.undoMove()
+        return check
+
+    '''
+    Build the check-evasion mask and the pin-line mask of every pinned piece from self.checks and self.pins,
+    so the generators can test each target square in O(1) and never emit an illegal non-king move
+    '''
+    def computeLegalityMasks(self, kingRow, kingCol):
+        kingSq = kingRow * 8 + kingCol
+        pinMasks = {}
+        for pin in self.pins:
+            pinMasks[SQUARES[pin[0]][pin[1]]] = RAY_MASKS[DIRECTION_INDEX[(pin[2], pin[3])]][kingSq]
+        self.pinMasks = pinMasks
+        self.kingMask = ALL_SQUARES
+        if not self.inCheck:
+            self.checkMask = ALL_SQUARES
+        elif len(self.checks) == 1:
+            checkRow, checkCol, dr, dc = self.checks[0]
+            direction = DIRECTION_INDEX.get((dr, dc))
+            if direction is None: # knight check, it can only be captured
+                self.checkMask = SQUARE_BITS[checkRow][checkCol]
+            else: # squares from the king up to and including the checking piece
+                self.checkMask = RAY_MASKS[direction][kingSq] & ~RAY_MASKS[direction][checkRow * 8 + checkCol]
+        else:
+            self.checkMask = 0
+
+    '''
+    Count the leaf nodes of the legal move tree to the given depth
+    '''
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        moves = self.getValidMovesAdvanced()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.undoMove()
+        return nodes
+
+    '''
+    Perft split by root move. Returns a dict of move notation to node count
+    '''
+    def divide(self, depth):
+        counts = {}
+        for move in self.getValidMovesAdvanced():
+            self.makeMove(move)
+            counts[move.getChessNotation()] = self.perft(depth - 1)
+            self.undoMove()
+        return counts
+
     '''
     Return whether king is in check
     '''
@@ -291,167 +655,178 @@ class GameState():
     Determine if the enemy can attack the square at row, col
     '''
     def squareUnderAttack(self, row, col):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == row and move.endCol == col:
-                return True
-        return False
+        return len(self.getAttackers(row, col, firstOnly=True)) != 0
+
+    '''
+    Squares of the pieces of attackerColor (default: the side not to move) that attack row, col.
+    Probes outward from the square with the attack tables instead of generating the attacker's moves.
+    With firstOnly it returns as soon as one attacker is found
+    '''
+    def getAttackers(self, row, col, attackerColor=None, firstOnly=False):
+        if attackerColor is None:
+            attackerColor = 'b' if self.whiteToMove else 'w'
+        defenderColor = 'w' if attackerColor == 'b' else 'b'
+        board = self.board
+        attackers = []
+        # a pawn attacks this square from where a defending pawn on this square would capture
+        pawn = attackerColor + 'p'
+        for square in PAWN_ATTACK_SQUARES[defenderColor][row][col]:
+            if board[square[0]][square[1]] == pawn:
+                attackers.append(square)
+                if firstOnly:
+                    return attackers
+        knight = attackerColor + 'N'
+        for square in KNIGHT_SQUARES[row][col]:
+            if board[square[0]][square[1]] == knight:
+                attackers.append(square)
+                if firstOnly:
+                    return attackers
+        king = attackerColor + 'K'
+        for square in KING_SQUARES[row][col]:
+            if board[square[0]][square[1]] == king:
+                attackers.append(square)
+                if firstOnly:
+                    return attackers
+        rays = RAYS[row][col]
+        for j in range(8):
+            slider = 'R' if j < 4 else 'B'
+            for square in rays[j]:
+                piece = board[square[0]][square[1]]
+                if piece != '--':
+                    if piece[0] == attackerColor and (piece[1] == slider or piece[1] == 'Q'):
+                        attackers.append(square)
+                        if firstOnly:
+                            return attackers
+                    break
+        return attackers
 
     '''
     All moves without checks
     '''
     def getAllPossibleMoves(self):
-        moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves)
+        self.checkMask = ALL_SQUARES
+        self.pinMasks = {}
+        self.kingMask = ALL_SQUARES
+        return self.getPieceMoves([])
+
+    '''
+    Moves of every piece of the side to move, filtered by the current checkMask and pinMasks
+    '''
+    def getPieceMoves(self, moves):
+        pieceSquares = self.pieceSquares
+        for piece in COLOR_PIECES['w' if self.whiteToMove else 'b']:
+            moveFunction = self.moveFunctions[piece[1]]
+            for row, col in pieceSquares[piece]:
+                moveFunction(row, col, moves)
         return moves
                     
     '''
     Get all possible pawn moves for pawn at row, col and add to moves
     '''
     def getPawnMoves(self, row, col, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        allowed = self.checkMask & self.pinMasks.get(SQUARES[row][col], ALL_SQUARES)
+        board = self.board
         if self.whiteToMove:
-            if self.board[row-1][col] == '--':
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((row, col), (row-1, col), self.board))
-                    if row == 6 and self.board[row-2][col] == '--':
-                        moves.append(Move((row, col), (row-2, col), self.board))
-            #captures
-            if col - 1 >= 0: # capture to left
-                if self.board[row-1][col-1][0] == 'b':
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((row, col), (row-1, col-1), self.board))
-                if (row-1, col-1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((row, col), (row-1, col-1), self.board, isEnpassant=True))
-            if col + 1 <= 7: # capture to right
-                if self.board[row-1][col+1][0] == 'b':
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((row, col), (row-1, col+1), self.board))
-                if (row-1, col+1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((row, col), (row-1, col+1), self.board, isEnpassant=True))
-        # black pawn moves
+            moveAmount = -1
+            startRow = 6
+            enemyColor = 'b'
+        else:
+            moveAmount = 1
+            startRow = 1
+            enemyColor = 'w'
+        endRow = row + moveAmount
+        if board[endRow][col] == '--':
+            if allowed & SQUARE_BITS[endRow][col]:
+                self.addPawnMove(SQUARES[row][col], SQUARES[endRow][col], moves)
+            if row == startRow and board[endRow + moveAmount][col] == '--' and allowed & SQUARE_BITS[endRow + moveAmount][col]:
+                moves.append(Move(SQUARES[row][col], SQUARES[endRow + moveAmount][col], board))
+        # captures to the left and to the right
+        for endSquare in PAWN_ATTACK_SQUARES['w' if self.whiteToMove else 'b'][row][col]:
+            endCol = endSquare[1]
+            if board[endRow][endCol][0] == enemyColor:
+                if allowed & SQUARE_BITS[endRow][endCol]:
+                    self.addPawnMove(SQUARES[row][col], endSquare, moves)
+            # en passant only answers a check by taking the checking pawn, and counts as a capture when staged
+            elif endSquare == self.enpassantPossible and self.checkMask & SQUARE_BITS[row][endCol] and \
+                    not self.enpassantExposesKing(row, col, endRow, endCol):
+                moves.append(Move(SQUARES[row][col], endSquare, board, isEnpassant=True))
+
+    '''
+    Add a pawn move, expanded into one move per promotion piece when it reaches the last rank
+    '''
+    def addPawnMove(self, startSquare, endSquare, moves):
+        if endSquare[0] == 0 or endSquare[0] == 7:
+            for promotionPiece in Move.promotionPieces:
+                moves.append(Move(startSquare, endSquare, self.board, promotionPiece=promotionPiece))
         else:
-            if self.board[row+1][col] == '--':
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((row, col), (row+1, col), self.board))
-                    if row == 1 and self.board[row+2][col] == '--':
-                        moves.append(Move((row, col), (row+2, col), self.board))
-            if col -1 >= 0:
-                if self.board[row+1][col-1][0] == 'w':
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((row, col), (row+1, col-1), self.board))
-                if (row+1, col-1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((row, col), (row+1, col-1), self.board, isEnpassant=True))
-            if col + 1 <= 7:
-                if self.board[row+1][col+1][0] == 'w':
-                    if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((row, col), (row+1, col+1), self.board))
-                if (row + 1, col + 1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((row, col), (row+1, col+1), self.board, isEnpassant=True))
+            moves.append(Move(startSquare, endSquare, self.board))
+
+    '''
+    En passant removes two pawns at once, which the masks can't describe: it may capture the checking pawn or
+    uncover a check along the rank. Play the capture on the board and look for checks directly
+    '''
+    def enpassantExposesKing(self, row, col, endRow, endCol):
+        pawn = self.board[row][col]
+        capturedPawn = self.board[row][endCol]
+        self.board[row][col] = '--'
+        self.board[row][endCol] = '--'
+        self.board[endRow][endCol] = pawn
+        inCheck = self.checkForPinsAndChecks()[0]
+        self.board[endRow][endCol] = '--'
+        self.board[row][endCol] = capturedPawn
+        self.board[row][col] = pawn
+        return inCheck
 
     '''
     Get all possible rook moves for rook at row, col and add to moves
     '''
     def getRookMoves(self, row, col, moves):
-        piecePinned = False
-        pinDirection = ()
-
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][1] != 'Q':
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for dir in directions:
-            for i in range (1, 8):
-                endRow = row + dir[0] * i
-                endCol = col + dir[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not piecePinned or pinDirection == dir or pinDirection == (-dir[0], -dir[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--': 
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
+        self.getSlidingMoves(row, col, (0, 1, 2, 3), moves)
 
     '''
     Get all possible knight moves for knight at row, col and add to moves
     '''
     def getKnightMoves(self, row, col, moves):
-        piecePinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if(self.pins[i][0] == row and self.pins[i][1] == col):
-                piecePinned = True
-                self.pins.remove(self.pins[i])
-                break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        allowed = self.checkMask & self.pinMasks.get(SQUARES[row][col], ALL_SQUARES)
+        if not allowed: # a pinned knight never lands on its pin line
+            return
         allyColor = "w" if self.whiteToMove else "b"
-        for move in knightMoves:
-            endRow = row + move[0]
-            endCol = col + move[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
+        board = self.board
+        startSquare = SQUARES[row][col]
+        for endRow, endCol in KNIGHT_SQUARES[row][col]:
+            if board[endRow][endCol][0] != allyColor and allowed & SQUARE_BITS[endRow][endCol]:
+                moves.append(Move(startSquare, SQUARES[endRow][endCol], board))
 
     '''
     Get all possible bishop moves for bishop at row, col and add to moves
     '''
     def getBishopMoves(self, row, col, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if(self.pins[i][0] == row and self.pins[i][1] == col):
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1))
+        self.getSlidingMoves(row, col, (4, 5, 6, 7), moves)
+
+    '''
+    Add moves along the precomputed rays of the given directions, stopping at the first piece.
+    Only targets inside the check mask and the piece's pin line are kept
+    '''
+    def getSlidingMoves(self, row, col, directions, moves):
+        allowed = self.checkMask & self.pinMasks.get(SQUARES[row][col], ALL_SQUARES)
+        if not allowed:
+            return
         enemyColor = "b" if self.whiteToMove else "w"
-        for dir in directions:
-            for i in range (1, 8):
-                endRow = row + dir[0] * i
-                endCol = col + dir[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not piecePinned or pinDirection == dir or pinDirection == (-dir[0], -dir[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--':
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
+        board = self.board
+        startSquare = SQUARES[row][col]
+        sq = row * 8 + col
+        rays = RAYS[row][col]
+        for j in directions:
+            if not allowed & RAY_MASKS[j][sq]:
+                continue
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == '--':
+                    if allowed & SQUARE_BITS[endRow][endCol]:
+                        moves.append(Move(startSquare, SQUARES[endRow][endCol], board))
                 else:
+                    if endPiece[0] == enemyColor and allowed & SQUARE_BITS[endRow][endCol]:
+                        moves.append(Move(startSquare, SQUARES[endRow][endCol], board))
                     break
 
     '''
@@ -466,31 +841,25 @@ class GameState():
     '''
     def getKingMoves(self, row, col, moves):
         allyColor = 'w' if self.whiteToMove else 'b'
-        direcions = ((-1, -1), (1, -1), (1, 1), (-1, 1), (-1, 0), (0, -1), (1, 0), (0, 1))
-        for i in range(8):
-            endRow = row + direcions[i][0]
-            endCol = col + direcions[i][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8 :
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (row, col)
-                    else:
-                        self.blackKingLocation = (row, col)
+        board = self.board
+        king = board[row][col]
+        # lift the king so squares further along a checking ray are seen as attacked
+        board[row][col] = '--'
+        kingMask = self.kingMask
+        for endSquare in KING_SQUARES[row][col]:
+            if board[endSquare[0]][endSquare[1]][0] != allyColor and kingMask & SQUARE_BITS[endSquare[0]][endSquare[1]] \
+                    and not self.squareUnderAttack(endSquare[0], endSquare[1]):
+                board[row][col] = king
+                moves.append(Move(SQUARES[row][col], endSquare, board))
+                board[row][col] = '--'
+        board[row][col] = king
     
     def getCastleMoves(self, row, col, moves, ):
         if self.inCheck: 
             return
-        if (self.whiteToMove and self.currentCastleRights.wks) or (not self.whiteToMove and self.currentCastleRights.bks):
+        if self.currentCastleRights & (WKS if self.whiteToMove else BKS):
             self.getKingSideCastleMoves(row, col, moves)
-        if (self.whiteToMove and self.currentCastleRights.wqs)  or (not self.whiteToMove and self.currentCastleRights.bqs):
+        if self.currentCastleRights & (WQS if self.whiteToMove else BQS):
             self.getQueenSideCastleMoves(row, col, moves )
     
     def getKingSideCastleMoves(self, row, col, moves):
@@ -504,4 +873,3 @@ class GameState():
             self.board[row][col-3] == "--":
             if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
                 moves.append(Move((row, col), (row, col-2), self.board, isCastle=True))
-
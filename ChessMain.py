@@ -1,14 +1,24 @@
 '''This is our main driver file. It will be responsible for handling user input and displaying the current game state'''
 
+import sys
 import pygame
 import ChessEngine
+import BitboardEngine
+from MoveCache import MoveCache
 
 pygame.init()
 WIDTH = HEIGHT = 512
 DIMENSIONS = 8
 SQ_SIZE = HEIGHT // DIMENSIONS
-MAX_FPS = 15
+MAX_FPS = 15 # frame cap when SLEEP_WHEN_IDLE is off
+# block on the event queue between events instead of redrawing at MAX_FPS
+SLEEP_WHEN_IDLE = True
 IMAGES = {}
+BOARD_COLORS = (pygame.Color('white'), pygame.Color('gray'))
+HIGHLIGHT_COLORS = {'selected': pygame.Color('blue'), 'target': pygame.Color('yellow')}
+# pass --bitboards to play on the bitboard position backend instead of the string grid
+ENGINE = BitboardEngine if '--bitboards' in sys.argv else ChessEngine
+MOVE_CACHE_SIZE = 4096 # positions whose legal moves are kept, so undo and redo don't regenerate them
 
 '''
 Initialize a global dictionary of images. This will be called exactly once in main
@@ -24,9 +34,12 @@ The main driver for our code
 def main():
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     clock = pygame.time.Clock()
-    gs = ChessEngine.GameState()
+    gs = ENGINE.GameState()
+    moveCache = MoveCache(MOVE_CACHE_SIZE)
     loadImages()
-    validMoves = gs.getValidMovesAdvanced()
+    renderer = BoardRenderer(screen)
+    validMoves = moveCache.getValidMoves(gs)
+    movesBySquares = indexMoves(validMoves)
     moveMade = False
     animate = True
     gameOver = False
@@ -36,7 +49,12 @@ def main():
     playerClicks = [] # keep track of player clicks (two tuples: [(6, 4), (4, 4)])
 
     while running:
-        for event in pygame.event.get():
+        if SLEEP_WHEN_IDLE:
+            # the screen only changes in response to events, so block until the next one instead of polling
+            events = [pygame.event.wait()] + pygame.event.get()
+        else:
+            events = pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -50,16 +68,15 @@ def main():
                 else:
                     selectedSquare = (row, col)
                     playerClicks.append(selectedSquare)
-               
+
                 if len(playerClicks) == 2: # if it is second click
-                    move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                    for i in range(len(validMoves)):
-                        if move == validMoves[i]:
-                            animate = True
-                            gs.makeMove(validMoves[i])
-                            moveMade = True
-                            selectedSquare = ()
-                            playerClicks = []
+                    move = movesBySquares.get((playerClicks[0], playerClicks[1]))
+                    if move is not None:
+                        animate = True
+                        gs.makeMove(move)
+                        moveMade = True
+                        selectedSquare = ()
+                        playerClicks = []
                     if not moveMade:
                         playerClicks = [selectedSquare]
 
@@ -68,118 +85,170 @@ def main():
                     animate = False
                     gs.undoMove()
                     moveMade = True
+                    gameOver = False
                 if event.key == pygame.K_r: # reset the board
-                    gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMovesAdvanced()
+                    gs = ENGINE.GameState()
+                    validMoves = moveCache.getValidMoves(gs)
+                    movesBySquares = indexMoves(validMoves)
                     selectedSquare = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
+                    gameOver = False
+            elif event.type == pygame.VIDEOEXPOSE: # the window was uncovered, its contents are gone
+                renderer.invalidate()
+
 
-        
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMovesAdvanced()
+                renderer.animateMove(gs.moveLog[-1], clock)
+            validMoves = moveCache.getValidMoves(gs)
+            movesBySquares = indexMoves(validMoves)
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, selectedSquare)
-
+        text = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, "Black wins by checkmate")
-            else: 
-                drawText(screen, "White wins by checkmate")
+                text = "Black wins by checkmate"
+            else:
+                text = "White wins by checkmate"
         elif gs.staleMate:
             gameOver = True
-            drawText(screen, "Game draw by stalemate")
-
-        clock.tick(MAX_FPS)
-        pygame.display.flip()
-
-'''
-Highlight possible mnove squared
-'''
-def highlightSquares(screen, gameState, validMoves, sqSelected):
-    if sqSelected == ():
-        return
-    row, col = sqSelected
-    # check if selected square belongs to the correct color's turn
-    if gameState.board[row][col][0] == ('w' if gameState.whiteToMove else 'b'):
-        # highlight selected square
-        s = pygame.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(100)
-        s.fill(pygame.Color('blue'))
-        screen.blit(s, (col * SQ_SIZE, row * SQ_SIZE))
-
-        # highlight moves
-        s.fill(pygame.Color('yellow'))
-        for move in validMoves:
-            if move.startRow == row and move.startCol == col:
-                screen.blit(s, (SQ_SIZE * move.endCol, SQ_SIZE * move.endRow))
+            text = "Game draw by stalemate"
+        elif gs.isThreefoldRepetition():
+            gameOver = True
+            text = "Game draw by repetition"
+        elif gs.canClaimFiftyMoves():
+            gameOver = True
+            text = "Game draw by fifty-move rule"
+        renderer.draw(gs, validMoves, selectedSquare, text)
 
-'''
-Responsible for all the graphics within current game state
-'''
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
-
-'''Draw the squares on the board'''
-def drawBoard(screen):
-    global colors
-    colors = [pygame.Color('white'), pygame.Color('gray')]
-    for row in range(DIMENSIONS):
-        for col in range(DIMENSIONS):
-            color = colors[((row + col) % 2)]
-            pygame.draw.rect(screen, color, pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-'''Draw the pieces on the board using the current GameState.board'''
-def drawPieces(screen, board):
-    for row in range(DIMENSIONS):
-        for col in range(DIMENSIONS):
-            piece = board[row][col]
-            if piece != '--': # not an empty space
-                screen.blit(IMAGES[piece], pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        if not SLEEP_WHEN_IDLE:
+            clock.tick(MAX_FPS)
 
 '''
-Animate piece movement
+Map (start square, end square) to the valid move between them, so a click pair is looked up in O(1).
+Promotions are generated queen first, so a click pair promotes to a queen
 '''
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    fps = min(18 // (abs(dR) + abs(dC)), 5)    # frames per square
-    frameCount = (abs(dR) + abs(dC)) * fps
-    for frame in range(frameCount + 1):
-        row, col = (move.startRow + dR*frame/frameCount, move.startCol + dC * frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase end piece
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = pygame.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        pygame.draw.rect(screen, color, endSquare)
-
-        # draw captured piece
-        if move.pieceCaptured != "--":
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        
-        # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        pygame.display.flip()
-        clock.tick(60)
+def indexMoves(validMoves):
+    movesBySquares = {}
+    for move in validMoves:
+        movesBySquares.setdefault(((move.startRow, move.startCol), (move.endRow, move.endCol)), move)
+    return movesBySquares
 
 '''
-Draw text to screen
+Draws the game into the display surface and remembers what every square shows, so a frame only repaints the
+squares that changed and passes just their rects to pygame.display.update. The board background, highlight
+surfaces, font and rendered messages are made once
 '''
-def drawText(screen, text):
-    font = pygame.font.SysFont("Helvetica", 32, True, False)
-    textObject = font.render(text, 0, pygame.Color('black'))
-    textLocation = pygame.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width() / 2, HEIGHT/2 - textObject.get_height() / 2)
-    screen.blit(textObject, textLocation)
+class BoardRenderer():
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = pygame.Surface((WIDTH, HEIGHT))
+        for row in range(DIMENSIONS):
+            for col in range(DIMENSIONS):
+                self.background.fill(BOARD_COLORS[(row + col) % 2], squareRect(row, col))
+        self.highlights = {}
+        for name, color in HIGHLIGHT_COLORS.items():
+            surface = pygame.Surface((SQ_SIZE, SQ_SIZE))
+            surface.set_alpha(100)
+            surface.fill(color)
+            self.highlights[name] = surface
+        self.font = pygame.font.SysFont("Helvetica", 32, True, False)
+        self.texts = {} # message -> (rendered surface, rect)
+        self.shown = None # (piece, highlight) on screen for every square, None until the first draw
+        self.text = None # message on screen
+        self.invalidate()
+
+    '''
+    Forget what is on screen, so the next draw repaints every square
+    '''
+    def invalidate(self):
+        self.shown = [[None] * DIMENSIONS for row in range(DIMENSIONS)]
+        self.text = None
+
+    '''
+    Bring the screen up to date with the board, the selected square's highlights and an optional message
+    '''
+    def draw(self, gs, validMoves, sqSelected, text=None):
+        highlights = {}
+        if sqSelected != ():
+            row, col = sqSelected
+            # check if selected square belongs to the correct color's turn
+            if gs.board[row][col][0] == ('w' if gs.whiteToMove else 'b'):
+                highlights[sqSelected] = 'selected'
+                for move in validMoves:
+                    if move.startRow == row and move.startCol == col:
+                        highlights[(move.endRow, move.endCol)] = 'target'
+
+        if self.text is not None and text != self.text:
+            # the old message goes away with the squares under it
+            oldRect = self.renderText(self.text)[1]
+            for row in range(DIMENSIONS):
+                for col in range(DIMENSIONS):
+                    if oldRect.colliderect(squareRect(row, col)):
+                        self.shown[row][col] = None
+
+        dirty = []
+        board = gs.board
+        for row in range(DIMENSIONS):
+            shownRow = self.shown[row]
+            for col in range(DIMENSIONS):
+                state = (board[row][col], highlights.get((row, col)))
+                if shownRow[col] != state:
+                    self.drawSquare(row, col, state[0], state[1])
+                    shownRow[col] = state
+                    dirty.append(squareRect(row, col))
+        if text is not None and (dirty or text != self.text):
+            surface, rect = self.renderText(text)
+            self.screen.blit(surface, rect)
+            dirty.append(rect)
+        self.text = text
+        if dirty:
+            pygame.display.update(dirty)
+
+    def drawSquare(self, row, col, piece, highlight=None):
+        rect = squareRect(row, col)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != '--':
+            self.screen.blit(IMAGES[piece], rect)
+
+    def renderText(self, text):
+        if text not in self.texts:
+            surface = self.font.render(text, 0, pygame.Color('black'))
+            self.texts[text] = (surface, surface.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
+        return self.texts[text]
+
+    '''
+    Animate piece movement of a move already made on the board. The scene without the moving piece is drawn
+    once, then each frame restores the piece's last rect from it and draws the piece at its next position
+    '''
+    def animateMove(self, move, clock):
+        dR = move.endRow - move.startRow
+        dC = move.endCol - move.startCol
+        fps = min(18 // (abs(dR) + abs(dC)), 5)    # frames per square
+        frameCount = (abs(dR) + abs(dC)) * fps
+        # the end square keeps showing the captured piece until the moving piece arrives
+        self.drawSquare(move.startRow, move.startCol, '--')
+        self.drawSquare(move.endRow, move.endCol, '--' if move.isEnpassant else move.pieceCaptured)
+        self.shown[move.startRow][move.startCol] = self.shown[move.endRow][move.endCol] = None
+        scene = self.screen.copy()
+        previous = squareRect(move.startRow, move.startCol)
+        for frame in range(frameCount + 1):
+            row, col = (move.startRow + dR*frame/frameCount, move.startCol + dC * frame/frameCount)
+            rect = pygame.Rect(round(col * SQ_SIZE), round(row * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+            self.screen.blit(scene, previous, previous)
+            self.screen.blit(IMAGES[move.pieceMoved], rect)
+            pygame.display.update([previous, rect])
+            previous = rect
+            clock.tick(60)
+
+def squareRect(row, col):
+    return pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
 
 if __name__=="__main__":
     main()
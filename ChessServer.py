@@ -0,0 +1,274 @@
+'''Headless multi-game server. Each connection can host any number of games, each on its own GameState, over a
+line protocol on a TCP or Unix socket:
+
+    new [fen]            -> ok <game id>
+    move <id> <move>     -> ok <fen> [checkmate|stalemate|repetition|fiftymoves]    (e.g. e2e4 or e7e8n)
+    moves <id>           -> ok <move> <move> ...                                    (sorted)
+    undo <id>            -> ok <fen>
+    fen <id>             -> ok <fen>
+    go <id> <depth>      -> ok <move> <score>                 (searches, doesn't play the move)
+    close <id>           -> ok
+    stats                -> ok sessions=<n> memory=<bytes> pending=<jobs>
+    quit
+
+Replies are one line, errors start with "error". Making and undoing moves is constant time and done on the event
+loop; legal move generation and search run in a process pool on the position's FEN, so the loop never blocks on
+CPU work. A semaphore bounds the pool jobs in flight and each connection handles one command at a time, so a
+client that floods the server stops being read until the work catches up. Every session's memory is estimated
+and capped, as is the total'''
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+from Move import Move
+from Search import Search
+
+MAX_PENDING = 256 # pool jobs in flight across all connections
+MAX_SESSION_BYTES = 1 << 20
+MAX_TOTAL_BYTES = 1 << 30
+MAX_LINE = 4096
+MAX_SEARCH_DEPTH = 8
+
+'''
+Approximate size in bytes of an object and everything it holds
+'''
+def deepSize(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepSize(key, seen) + deepSize(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deepSize(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deepSize(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    elif hasattr(obj, '__dict__'):
+        size += deepSize(obj.__dict__, seen)
+    return size
+
+# bytes one more ply adds to a session: the Move in the move log and its list slot
+PLY_BYTES = deepSize(Move((6, 4), (4, 4), ChessEngine.GameState().board)) + 8
+# bytes of a session's GameState without its move log. Measured once, a position's size barely depends on the position
+BASE_BYTES = deepSize(ChessEngine.GameState()) - deepSize([])
+
+'''
+Worker process side: (packed, notation) of every legal move of a FEN position
+'''
+def legalMoves(fen):
+    return [(move.packed, move.getChessNotation()) for move in ChessEngine.GameState.fromFen(fen).getValidMovesAdvanced()]
+
+'''
+Worker process side: play the move in notation on a FEN position. Returns (packed move, legal moves after it as
+legalMoves gives them), or (0, []) if the move isn't legal
+'''
+def playMove(fen, notation):
+    gs = ChessEngine.GameState.fromFen(fen)
+    for move in gs.getValidMovesAdvanced():
+        if move.getChessNotation() == notation:
+            gs.makeMove(move)
+            return move.packed, [(reply.packed, reply.getChessNotation()) for reply in gs.getValidMovesAdvanced()]
+    return 0, []
+
+'''
+Worker process side: (packed best move or 0, score) of a search of a FEN position
+'''
+def searchPosition(fen, depth):
+    result = Search(ChessEngine.GameState.fromFen(fen), depth).search()
+    return (result.bestMove.packed if result.bestMove is not None else 0), result.score
+
+class Session():
+    def __init__(self, gs):
+        self.gs = gs
+        self.legal = None # (zobrist key, {notation: packed}) of the last position moves were generated for
+        self.baseBytes = BASE_BYTES
+
+    def memory(self):
+        size = self.baseBytes + len(self.gs.moveLog) * PLY_BYTES
+        if self.legal is not None:
+            size += len(self.legal[1]) * 2 * PLY_BYTES
+        return size
+
+class ChessServer():
+    def __init__(self, workers=None, maxPending=MAX_PENDING, maxSessionBytes=MAX_SESSION_BYTES,
+                 maxTotalBytes=MAX_TOTAL_BYTES):
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        self.pending = asyncio.Semaphore(maxPending)
+        self.inFlight = 0
+        self.maxSessionBytes = maxSessionBytes
+        self.maxTotalBytes = maxTotalBytes
+        self.sessions = {} # game id -> Session, across all connections
+        self.gameIds = itertools.count(1)
+        self.commands = {'new': self.newGame, 'move': self.move, 'moves': self.moves, 'undo': self.undo,
+                         'fen': self.fen, 'go': self.go, 'close': self.closeGame, 'stats': self.stats}
+
+    def totalMemory(self):
+        return sum(session.memory() for session in self.sessions.values())
+
+    '''
+    Run fn(*args) in the process pool, waiting for a free slot first
+    '''
+    async def runInPool(self, fn, *args):
+        async with self.pending:
+            self.inFlight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+            finally:
+                self.inFlight -= 1
+
+    '''
+    {notation: packed} of the legal moves of a session's current position, generated in the pool once per position
+    '''
+    async def legalMoves(self, session):
+        key = session.gs.zobristKey
+        if session.legal is None or session.legal[0] != key:
+            moves = await self.runInPool(legalMoves, session.gs.toFen())
+            session.legal = (key, {notation: packed for packed, notation in moves})
+        return session.legal[1]
+
+    def session(self, owned, args):
+        if not args or args[0] not in owned:
+            raise ValueError("unknown game")
+        return self.sessions[args[0]]
+
+    async def newGame(self, owned, args):
+        if self.totalMemory() > self.maxTotalBytes:
+            raise ValueError("server full")
+        gs = ChessEngine.GameState.fromFen(' '.join(args)) if args else ChessEngine.GameState()
+        gameId = str(next(self.gameIds))
+        self.sessions[gameId] = Session(gs)
+        owned.add(gameId)
+        return gameId
+
+    async def move(self, owned, args):
+        session = self.session(owned, args)
+        if len(args) != 2:
+            raise ValueError("usage: move <id> <move>")
+        if session.memory() + PLY_BYTES > self.maxSessionBytes:
+            raise ValueError("session memory limit reached")
+        gs = session.gs
+        if session.legal is not None and session.legal[0] == gs.zobristKey:
+            # the moves of this position came with the previous move, only the next position's are needed
+            if args[1] not in session.legal[1]:
+                raise ValueError("illegal move")
+            gs.makeMove(Move.fromPacked(session.legal[1][args[1]], gs.board))
+            legal = await self.legalMoves(session)
+        else: # one pool job checks the move and generates the moves after it
+            packed, moves = await self.runInPool(playMove, gs.toFen(), args[1])
+            if not packed:
+                raise ValueError("illegal move")
+            gs.makeMove(Move.fromPacked(packed, gs.board))
+            legal = {notation: packed for packed, notation in moves}
+            session.legal = (gs.zobristKey, legal)
+        reply = gs.toFen()
+        if not legal:
+            kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+            reply += ' checkmate' if gs.squareUnderAttack(kingRow, kingCol) else ' stalemate'
+        elif gs.isThreefoldRepetition():
+            reply += ' repetition'
+        elif gs.canClaimFiftyMoves():
+            reply += ' fiftymoves'
+        return reply
+
+    async def moves(self, owned, args):
+        return ' '.join(sorted(await self.legalMoves(self.session(owned, args))))
+
+    async def undo(self, owned, args):
+        session = self.session(owned, args)
+        session.gs.undoMove()
+        return session.gs.toFen()
+
+    async def fen(self, owned, args):
+        return self.session(owned, args).gs.toFen()
+
+    async def go(self, owned, args):
+        session = self.session(owned, args)
+        depth = int(args[1]) if len(args) > 1 else 3
+        if not 1 <= depth <= MAX_SEARCH_DEPTH:
+            raise ValueError(f"depth must be 1-{MAX_SEARCH_DEPTH}")
+        packed, score = await self.runInPool(searchPosition, session.gs.toFen(), depth)
+        if not packed:
+            return f"none {score}"
+        return f"{Move.fromPacked(packed, session.gs.board).getChessNotation()} {score}"
+
+    async def closeGame(self, owned, args):
+        self.session(owned, args)
+        owned.discard(args[0])
+        del self.sessions[args[0]]
+        return ''
+
+    async def stats(self, owned, args):
+        return f"sessions={len(self.sessions)} memory={self.totalMemory()} pending={self.inFlight}"
+
+    '''
+    Serve one connection, one command at a time. Its games are dropped when it disconnects
+    '''
+    async def handleClient(self, reader, writer):
+        owned = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(b"error line too long\n")
+                    break
+                words = line.decode('utf-8', errors='replace').split()
+                if not words:
+                    continue
+                if words[0] == 'quit':
+                    break
+                command = self.commands.get(words[0])
+                if command is None:
+                    reply = f"error unknown command {words[0]}"
+                else:
+                    try:
+                        reply = ('ok ' + await command(owned, words[1:])).rstrip()
+                    except ValueError as error:
+                        reply = f"error {error}"
+                writer.write(reply.encode() + b'\n')
+                await writer.drain() # don't read more from a client that isn't reading its replies
+        except ConnectionError:
+            pass
+        finally:
+            for gameId in owned:
+                del self.sessions[gameId]
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handleClient, path=path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self.handleClient, host, port, limit=MAX_LINE)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many chess games over a line protocol")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help="listen on this Unix socket path instead of TCP")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING, help="pool jobs in flight")
+    args = parser.parse_args(argv)
+    server = ChessServer(args.workers, args.max_pending)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+'''UCI front-end, so the engine can be driven by standard GUIs, tournament managers and analysis tools.
+Commands are read on the main thread; a search runs on a background thread, so stop and isready are answered
+right away while it thinks. stop asks the search to finish at its next node and bestmove follows immediately'''
+
+import sys
+import threading
+import time
+import ChessEngine
+from Search import Search, MATE_SCORE, MAX_PLY
+from TranspositionTable import TranspositionTable
+
+ENGINE_NAME = 'python-chess'
+ENGINE_AUTHOR = 'vykhy'
+DEFAULT_HASH_MB = 16
+MOVE_OVERHEAD = 0.05 # seconds kept back from every move for communication
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        # FEN of the position as last set up, for d: the search thread makes and undoes moves on self.gs
+        self.fen = self.gs.toFen()
+        self.tt = TranspositionTable(DEFAULT_HASH_MB)
+        self.search = None
+        self.searchThread = None
+        self.infinite = False
+        self.stopEvent = threading.Event() # set by stop, ends an infinite search
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    '''
+    Handle one command line. Returns False when the engine should quit. Bad input, e.g. a number that isn't one or
+    an invalid FEN, is reported as an info string and the engine keeps going
+    '''
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        try:
+            return self.dispatch(words[0], words[1:])
+        except ValueError as error:
+            self.send(f"info string {error}")
+            return True
+
+    def dispatch(self, command, args):
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 1024")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            self.stopSearch()
+            self.tt.clear()
+        elif command == 'position':
+            self.stopSearch()
+            self.setPosition(args)
+            self.fen = self.gs.toFen()
+        elif command == 'go':
+            self.stopSearch()
+            self.go(args)
+        elif command == 'stop':
+            self.stopSearch()
+        elif command == 'perft':
+            self.stopSearch()
+            self.perft(int(args[0]) if args else 1)
+        elif command == 'd':
+            self.send(self.fen)
+        elif command == 'quit':
+            self.stopSearch()
+            return False
+        return True
+
+    def setOption(self, args):
+        text = ' '.join(args)
+        if text.lower().startswith('name hash value '):
+            self.stopSearch()
+            self.tt = TranspositionTable(max(1, int(text.split()[-1])))
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]
+    '''
+    def setPosition(self, args):
+        moves = args.index('moves') if 'moves' in args else len(args)
+        if args and args[0] == 'fen':
+            self.gs = ChessEngine.GameState.fromFen(' '.join(args[1:moves]))
+        else:
+            self.gs = ChessEngine.GameState()
+        for notation in args[moves + 1:]:
+            for move in self.gs.getValidMovesAdvanced():
+                if move.getChessNotation() == notation:
+                    self.gs.makeMove(move)
+                    break
+            else:
+                self.send(f"info string illegal move {notation}")
+                return
+
+    '''
+    Seconds to spend on this move from the go parameters, or None for no time limit
+    '''
+    def timeLimit(self, params):
+        if 'movetime' in params:
+            return max(0.001, params['movetime'] / 1000 - MOVE_OVERHEAD)
+        remaining = params.get('wtime' if self.gs.whiteToMove else 'btime')
+        if remaining is None:
+            return None
+        increment = params.get('winc' if self.gs.whiteToMove else 'binc', 0)
+        movesToGo = params.get('movestogo', 30)
+        budget = remaining / max(1, movesToGo) + increment * 0.8
+        return max(0.001, min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD)
+
+    '''
+    go [depth N] [nodes N] [movetime MS] [wtime MS btime MS winc MS binc MS movestogo N] [infinite] [perft N]
+    '''
+    def go(self, args):
+        if args and args[0] == 'perft':
+            self.perft(int(args[1]) if len(args) > 1 else 1)
+            return
+        params = {}
+        for i in range(len(args) - 1):
+            if args[i] in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo'):
+                params[args[i]] = int(args[i + 1])
+        self.infinite = 'infinite' in args
+        self.stopEvent.clear()
+        self.search = Search(self.gs, params.get('depth', MAX_PLY), None if self.infinite else self.timeLimit(params),
+                             params.get('nodes'), self.sendInfo, self.tt)
+        self.searchThread = threading.Thread(target=self.runSearch, args=(self.search,), daemon=True)
+        self.searchThread.start()
+
+    def runSearch(self, search):
+        result = search.search()
+        if self.infinite:
+            # UCI wants bestmove only after stop, even if the search ran out of depth
+            self.stopEvent.wait()
+        self.send(f"bestmove {result.bestMove.getChessNotation() if result.bestMove is not None else '0000'}")
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.search.stop()
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+            self.search = None
+
+    def sendInfo(self, result):
+        if abs(result.score) >= MATE_SCORE - MAX_PLY:
+            plies = MATE_SCORE - abs(result.score)
+            score = f"mate {(plies + 1) // 2 if result.score > 0 else -(plies // 2)}"
+        else:
+            score = f"cp {result.score}"
+        pv = ' '.join(move.getChessNotation() for move in result.pv)
+        self.send(f"info depth {result.depth} score {score} nodes {result.nodes} nps {result.nps} "
+                  f"time {int(result.elapsed * 1000)} hashfull {self.tt.hashfull()} pv {pv}")
+
+    def perft(self, depth):
+        start = time.perf_counter()
+        counts = self.gs.divide(depth)
+        for notation in sorted(counts):
+            self.send(f"{notation}: {counts[notation]}")
+        elapsed = time.perf_counter() - start
+        nodes = sum(counts.values())
+        self.send("")
+        self.send(f"Nodes searched: {nodes}")
+        self.send(f"info string perft {depth} in {elapsed:.3f}s, {int(nodes / elapsed) if elapsed > 0 else 0} nps")
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stopSearch()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+'''Draw rules shared by both GameState backends: repetitions and the fifty- and seventy-five-move rules. They
+only need the halfmove clock, the zobrist key and the undo stack, whose records hold the key before every move,
+so the hash history costs nothing extra to keep in step with makeMove/undoMove'''
+
+class DrawRules():
+    '''
+    How many times the current position has occurred, counting now. The undo records hold the zobrist key before
+    every move, so this compares keys with the same side to move back to the last capture or pawn move; nothing
+    older can repeat. Positions before the last setPosition are not known. Counting stops early once it reaches
+    stopAt
+    '''
+    def repetitionCount(self, stopAt=0):
+        undoStack = self.undoStack
+        key = self.zobristKey
+        ply = len(self.moveLog)
+        count = 1
+        # a position can't come back sooner than 4 plies later
+        for i in range(ply - 4, max(ply - self.halfmoveClock, 0) - 1, -2):
+            if undoStack[i][2] == key:
+                count += 1
+                if count == stopAt:
+                    break
+        return count
+
+    '''
+    Whether the current position occurred before. Cheap enough for every search node
+    '''
+    def isRepetition(self):
+        return self.halfmoveClock >= 4 and self.repetitionCount(2) >= 2
+
+    '''
+    Draw claimable by threefold repetition
+    '''
+    def isThreefoldRepetition(self):
+        return self.halfmoveClock >= 8 and self.repetitionCount(3) >= 3
+
+    '''
+    Draw by fivefold repetition, automatic without a claim
+    '''
+    def isFivefoldRepetition(self):
+        return self.halfmoveClock >= 16 and self.repetitionCount(5) >= 5
+
+    '''
+    Draw claimable by the fifty-move rule: no capture or pawn move for 100 plies. A checkmate on the last of them
+    still wins, so check for mate first
+    '''
+    def canClaimFiftyMoves(self):
+        return self.halfmoveClock >= 100
+
+    '''
+    Draw by the seventy-five-move rule, automatic without a claim
+    '''
+    def isSeventyFiveMoves(self):
+        return self.halfmoveClock >= 150
+
+    '''
+    Whether the side to move can claim a draw by threefold repetition or the fifty-move rule
+    '''
+    def canClaimDraw(self):
+        return self.canClaimFiftyMoves() or self.isThreefoldRepetition()
@@ -0,0 +1,144 @@
+'''Static evaluation: material plus piece-square tables, with separate middlegame and endgame values blended by how
+much material is left. Every (piece, square) gets a fixed middlegame score, endgame score and phase weight, so a
+position's evaluation is the sum over its pieces and makeMove/undoMove keep it up to date by adding in only the
+pieces that change, like the zobrist key. Evaluating a leaf then never looks at the board'''
+
+# material, tapered between middlegame and endgame
+MG_MATERIAL = {'p': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+EG_MATERIAL = {'p': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+# game phase each piece is worth. 24 with all pieces on the board, 0 with only kings and pawns
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+# piece values for ordering captures
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# bonus per square for a white piece, rows as on the board (rank 8 first). Black uses the table mirrored
+PAWN_MG = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    ( 50,  50,  50,  50,  50,  50,  50,  50),
+    ( 10,  10,  20,  30,  30,  20,  10,  10),
+    (  5,   5,  10,  25,  25,  10,   5,   5),
+    (  0,   0,   0,  20,  20,   0,   0,   0),
+    (  5,  -5, -10,   0,   0, -10,  -5,   5),
+    (  5,  10,  10, -20, -20,  10,  10,   5),
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+)
+PAWN_EG = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    ( 80,  80,  80,  80,  80,  80,  80,  80),
+    ( 50,  50,  50,  50,  50,  50,  50,  50),
+    ( 30,  30,  30,  30,  30,  30,  30,  30),
+    ( 20,  20,  20,  20,  20,  20,  20,  20),
+    ( 10,  10,  10,  10,  10,  10,  10,  10),
+    ( 10,  10,  10,  10,  10,  10,  10,  10),
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+)
+KNIGHT = (
+    (-50, -40, -30, -30, -30, -30, -40, -50),
+    (-40, -20,   0,   0,   0,   0, -20, -40),
+    (-30,   0,  10,  15,  15,  10,   0, -30),
+    (-30,   5,  15,  20,  20,  15,   5, -30),
+    (-30,   0,  15,  20,  20,  15,   0, -30),
+    (-30,   5,  10,  15,  15,  10,   5, -30),
+    (-40, -20,   0,   5,   5,   0, -20, -40),
+    (-50, -40, -30, -30, -30, -30, -40, -50),
+)
+BISHOP = (
+    (-20, -10, -10, -10, -10, -10, -10, -20),
+    (-10,   0,   0,   0,   0,   0,   0, -10),
+    (-10,   0,   5,  10,  10,   5,   0, -10),
+    (-10,   5,   5,  10,  10,   5,   5, -10),
+    (-10,   0,  10,  10,  10,  10,   0, -10),
+    (-10,  10,  10,  10,  10,  10,  10, -10),
+    (-10,   5,   0,   0,   0,   0,   5, -10),
+    (-20, -10, -10, -10, -10, -10, -10, -20),
+)
+ROOK_MG = (
+    (  0,   0,   0,   0,   0,   0,   0,   0),
+    (  5,  10,  10,  10,  10,  10,  10,   5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    ( -5,   0,   0,   0,   0,   0,   0,  -5),
+    (  0,   0,   0,   5,   5,   0,   0,   0),
+)
+ROOK_EG = ((0,) * 8,) * 8
+QUEEN = (
+    (-20, -10, -10,  -5,  -5, -10, -10, -20),
+    (-10,   0,   0,   0,   0,   0,   0, -10),
+    (-10,   0,   5,   5,   5,   5,   0, -10),
+    ( -5,   0,   5,   5,   5,   5,   0,  -5),
+    (  0,   0,   5,   5,   5,   5,   0,  -5),
+    (-10,   5,   5,   5,   5,   5,   0, -10),
+    (-10,   0,   5,   0,   0,   0,   0, -10),
+    (-20, -10, -10,  -5,  -5, -10, -10, -20),
+)
+KING_MG = (
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-30, -40, -40, -50, -50, -40, -40, -30),
+    (-20, -30, -30, -40, -40, -30, -30, -20),
+    (-10, -20, -20, -20, -20, -20, -20, -10),
+    ( 20,  20,   0,   0,   0,   0,  20,  20),
+    ( 20,  30,  10,   0,   0,  10,  30,  20),
+)
+KING_EG = (
+    (-50, -40, -30, -20, -20, -30, -40, -50),
+    (-30, -20, -10,   0,   0, -10, -20, -30),
+    (-30, -10,  20,  30,  30,  20, -10, -30),
+    (-30, -10,  30,  40,  40,  30, -10, -30),
+    (-30, -10,  30,  40,  40,  30, -10, -30),
+    (-30, -10,  20,  30,  30,  20, -10, -30),
+    (-30, -30,   0,   0,   0,   0, -30, -30),
+    (-50, -30, -30, -30, -30, -30, -30, -50),
+)
+MG_SQUARE_BONUS = {'p': PAWN_MG, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK_MG, 'Q': QUEEN, 'K': KING_MG}
+EG_SQUARE_BONUS = {'p': PAWN_EG, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK_EG, 'Q': QUEEN, 'K': KING_EG}
+
+'''
+piece -> row -> col -> material plus square bonus, from white's point of view (black pieces count negative)
+'''
+def buildTables(material, squareBonus):
+    tables = {}
+    for kind in material:
+        tables['w' + kind] = [[material[kind] + squareBonus[kind][row][col] for col in range(8)] for row in range(8)]
+        tables['b' + kind] = [[-material[kind] - squareBonus[kind][7 - row][col] for col in range(8)]
+                              for row in range(8)]
+    return tables
+
+MG_TABLES = buildTables(MG_MATERIAL, MG_SQUARE_BONUS)
+EG_TABLES = buildTables(EG_MATERIAL, EG_SQUARE_BONUS)
+PHASES = {color + kind: weight for color in 'wb' for kind, weight in PHASE_WEIGHTS.items()}
+
+'''
+(middlegame score, endgame score, phase) of a board computed from scratch. Only used to seed a GameState and to
+check the incremental scores
+'''
+def computeScores(board):
+    mgScore = egScore = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != '--':
+                mgScore += MG_TABLES[piece][row][col]
+                egScore += EG_TABLES[piece][row][col]
+                phase += PHASES[piece]
+    return mgScore, egScore, phase
+
+'''
+Tapered evaluation of a GameState from the point of view of the side to move, from its incremental scores
+'''
+def evaluate(gs):
+    phase = min(gs.phase, MAX_PHASE) # early promotions can push the phase over the maximum
+    score = (gs.mgScore * phase + gs.egScore * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if gs.whiteToMove else -score
+
+'''
+Most valuable victim, least valuable attacker ordering key (higher is searched first)
+'''
+def mvvLva(move):
+    if move.pieceCaptured == '--':
+        return 0
+    return 10 * PIECE_VALUES[move.pieceCaptured[1]] - PIECE_VALUES[move.pieceMoved[1]] + 10000
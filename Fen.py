@@ -0,0 +1,150 @@
+'''FEN and EPD support. parseFen/formatFen convert between FEN strings and the fields a GameState is made of,
+readFenFile streams positions out of FEN/EPD files one line at a time, so files with millions of positions are
+never held in memory'''
+
+from CastleRights import castleRightsFromString, castleRightsToString
+from AttackTables import PAWN_ATTACK_SQUARES
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# FEN letter -> board piece and back
+FEN_TO_PIECE = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+                'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+PIECE_TO_FEN = {value: key for key, value in FEN_TO_PIECE.items()}
+
+'''
+Split a FEN string into (board, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber).
+The move counters may be left out, as in EPD, and default to 0 and 1. Raises ValueError on malformed input
+'''
+def parseFen(fen):
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError(f"FEN needs at least 4 fields: {fen!r}")
+    ranks = fields[0].split('/')
+    if len(ranks) != 8:
+        raise ValueError(f"FEN board needs 8 ranks: {fen!r}")
+    board = []
+    for rank in ranks:
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend(['--'] * int(char))
+            elif char in FEN_TO_PIECE:
+                row.append(FEN_TO_PIECE[char])
+            else:
+                raise ValueError(f"unknown piece {char!r} in FEN: {fen!r}")
+        if len(row) != 8:
+            raise ValueError(f"FEN rank {rank!r} does not have 8 squares: {fen!r}")
+        board.append(row)
+    checkBoard(board)
+    if fields[1] not in ('w', 'b'):
+        raise ValueError(f"side to move must be w or b: {fen!r}")
+    if fields[3] == '-':
+        enpassantPossible = ()
+    elif len(fields[3]) == 2 and fields[3][0] in 'abcdefgh' and fields[3][1] in '36':
+        enpassantPossible = (8 - int(fields[3][1]), ord(fields[3][0]) - ord('a'))
+    else:
+        raise ValueError(f"bad en passant square {fields[3]!r}: {fen!r}")
+    halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    return board, fields[1] == 'w', castleRightsFromString(fields[2]), enpassantPossible, halfmoveClock, fullmoveNumber
+
+'''
+Raise ValueError unless board has exactly one king of each color and no pawn on the first or last rank, the
+positions the move generators can handle
+'''
+def checkBoard(board):
+    pieces = [piece for row in board for piece in row]
+    if pieces.count('wK') != 1 or pieces.count('bK') != 1:
+        raise ValueError("a position needs exactly one king of each color")
+    if 'wp' in board[0] or 'bp' in board[0] or 'wp' in board[7] or 'bp' in board[7]:
+        raise ValueError("a pawn can't stand on the first or last rank")
+
+'''
+The en passant square if a pawn of the side to move stands beside the pawn that just pushed past it, else ().
+A square nobody can take on changes nothing, and keeping it out of the zobrist key lets the position match its
+later repeats
+'''
+def capturableEnpassant(board, whiteToMove, enpassantPossible):
+    if enpassantPossible == ():
+        return ()
+    row, col = enpassantPossible
+    # the square the pawn skipped: on the third rank seen from the pushing side, empty, with the pawn beyond it
+    pushedRow = row + 1 if whiteToMove else row - 1
+    if row != (2 if whiteToMove else 5) or board[row][col] != '--' or \
+            board[pushedRow][col] != ('bp' if whiteToMove else 'wp'):
+        raise ValueError(f"no pawn can have just skipped the en passant square {enpassantPossible}")
+    # a capturing pawn stands where a pawn of the pushing side on the en passant square would attack
+    pawn = 'wp' if whiteToMove else 'bp'
+    for beside in PAWN_ATTACK_SQUARES['b' if whiteToMove else 'w'][row][col]:
+        if board[beside[0]][beside[1]] == pawn:
+            return enpassantPossible
+    return ()
+
+'''
+FEN string of the given position fields
+'''
+def formatFen(board, whiteToMove, castleRights, enpassantPossible, halfmoveClock=0, fullmoveNumber=1):
+    ranks = []
+    for row in board:
+        rank = ''
+        empty = 0
+        for piece in row:
+            if piece == '--':
+                empty += 1
+            else:
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += PIECE_TO_FEN[piece]
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    if enpassantPossible != ():
+        enpassant = 'abcdefgh'[enpassantPossible[1]] + str(8 - enpassantPossible[0])
+    else:
+        enpassant = '-'
+    return ' '.join(('/'.join(ranks), 'w' if whiteToMove else 'b', castleRightsToString(castleRights), enpassant,
+                     str(halfmoveClock), str(fullmoveNumber)))
+
+'''
+Split an EPD line into its FEN and its operations, e.g. {'bm': 'Nf3', 'id': '"WAC.001"'}.
+The hmvc/fmvn operations become the FEN move counters. Plain FEN lines come back with no operations
+'''
+def parseEpd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"EPD needs at least 4 fields: {line!r}")
+    position = fields[:4]
+    rest = fields[4] if len(fields) > 4 else ''
+    counters = rest.split()
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        # a full FEN line, nothing follows the move counters
+        return ' '.join(position + counters[:2]), {}
+    operations = {}
+    for operation in rest.split(';'):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(' ')
+            operations[opcode] = operand.strip()
+    position.append(operations.get('hmvc', '0'))
+    position.append(operations.get('fmvn', '1'))
+    return ' '.join(position), operations
+
+'''
+Yield (fen, operations) for every position in a FEN or EPD file, reading it lazily line by line.
+Blank lines and lines starting with # are skipped
+'''
+def readFenFile(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield parseEpd(line)
+
+'''
+Yield a GameState of the given class for every position in a FEN or EPD file
+'''
+def loadPositions(path, gameStateClass):
+    for fen, operations in readFenFile(path):
+        yield gameStateClass.fromFen(fen)
@@ -0,0 +1,218 @@
+'''Opt-in profiling of the move generator. enable() swaps the hot GameState methods and Move.__init__ on their
+classes for wrappers that count calls and time them, disable() puts the original functions back, so when profiling
+is off the engine runs exactly the code it always does with no wrapper left in between. Every call's self time is
+also added to its call stack, so a run can be exported as JSON stats or as folded stacks for flamegraph.pl and
+speedscope:
+
+    profiler = Profiler('endgame')
+    with profiler.profiling(gs):
+        gs.perft(4)
+    profiler.writeJson('endgame.json')
+    profiler.writeFolded('endgame.folded')
+
+GameState keeps its per-piece generators in a dict of bound methods, so the states in use are passed in and have
+that dict rebound on enable and disable, as do the GameStates created while profiling. A generator method such as
+generateMovesStaged counts one call and is timed while it runs, not while its caller works between moves. Not
+thread safe: profile one search at a time'''
+
+import argparse
+import inspect
+import json
+import sys
+import time
+import weakref
+from contextlib import contextmanager
+import ChessEngine
+import Fen
+from Move import Move
+from Search import Search
+
+# GameState methods that are wrapped, callers before callees
+GAME_STATE_METHODS = (
+    'getValidMovesAdvanced', 'generateMovesStaged', 'getCaptureMoves', 'getAllPossibleMoves', 'prepareLegality',
+    'checkForPinsAndChecks', 'computeLegalityMasks', 'addTargetMoves', 'addQuietPromotions', 'getPieceMoves',
+    'getPawnMoves', 'getKnightMoves', 'getBishopMoves', 'getRookMoves', 'getQueenMoves', 'getKingMoves',
+    'getSlidingMoves', 'getCastleMoves', 'enpassantExposesKing', 'squareUnderAttack', 'getAttackers', 'makeMove',
+    'undoMove',
+)
+MOVE_INIT = 'Move.__init__'
+
+class Profiler():
+    def __init__(self, label='engine'):
+        self.label = label # root frame of the folded stacks, e.g. the workload's name
+        self.originals = {} # (class, attribute) -> original function while enabled
+        self.states = weakref.WeakSet() # GameStates whose moveFunctions hold wrappers while enabled
+        self.reset()
+
+    '''
+    Forget the counts. The wrappers hold on to the count dicts, so this only works while disabled
+    '''
+    def reset(self):
+        if self.enabled:
+            raise ValueError("can't reset an enabled profiler")
+        self.calls = {} # function name -> calls
+        self.totalTime = {} # function name -> seconds including callees
+        self.selfTime = {} # function name -> seconds excluding callees
+        self.stackTime = {} # "label;caller;callee" -> self seconds
+        self.elapsed = 0.0
+        # one [path, seconds spent in callees] per active call, the bottom one stands for the label
+        self.frames = [[self.label, 0.0]]
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    '''
+    Wrap fn so every call is counted and timed under name. A generator function is timed over each of its steps
+    '''
+    def wrap(self, name, fn):
+        frames = self.frames
+        calls, totalTime, selfTime, stackTime = self.calls, self.totalTime, self.selfTime, self.stackTime
+        clock = time.perf_counter
+        def timed(step, *args, **kwargs):
+            frame = [frames[-1][0] + ';' + name, 0.0]
+            frames.append(frame)
+            start = clock()
+            try:
+                return step(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                frames.pop()
+                frames[-1][1] += elapsed
+                own = elapsed - frame[1]
+                totalTime[name] = totalTime.get(name, 0.0) + elapsed
+                selfTime[name] = selfTime.get(name, 0.0) + own
+                stackTime[frame[0]] = stackTime.get(frame[0], 0.0) + own
+        if inspect.isgeneratorfunction(fn):
+            def wrapper(*args, **kwargs):
+                calls[name] = calls.get(name, 0) + 1
+                generator = fn(*args, **kwargs)
+                while True:
+                    try:
+                        item = timed(next, generator)
+                    except StopIteration:
+                        return
+                    yield item
+        else:
+            def wrapper(*args, **kwargs):
+                calls[name] = calls.get(name, 0) + 1
+                return timed(fn, *args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    '''
+    Start counting. states are the existing GameStates that will be used while profiling; ones created after this
+    are found on their own
+    '''
+    def enable(self, *states):
+        if self.enabled:
+            raise ValueError("profiler is already enabled")
+        for name in GAME_STATE_METHODS:
+            self.patch(ChessEngine.GameState, name, name)
+        self.patch(Move, '__init__', MOVE_INIT)
+        # every GameState that binds the wrappers is remembered, so disable can bind the originals back
+        bindMoveFunctions = ChessEngine.GameState.__dict__['bindMoveFunctions']
+        self.originals[(ChessEngine.GameState, 'bindMoveFunctions')] = bindMoveFunctions
+        tracked = self.states
+        def trackingBind(gs):
+            tracked.add(gs)
+            bindMoveFunctions(gs)
+        ChessEngine.GameState.bindMoveFunctions = trackingBind
+        for gs in states:
+            gs.bindMoveFunctions()
+        self.started = time.perf_counter()
+
+    def patch(self, cls, attribute, name):
+        original = cls.__dict__[attribute]
+        self.originals[(cls, attribute)] = original
+        setattr(cls, attribute, self.wrap(name, original))
+
+    '''
+    Stop counting and restore the original methods. The counts are kept until reset
+    '''
+    def disable(self):
+        if not self.enabled:
+            return
+        self.elapsed += time.perf_counter() - self.started
+        for (cls, attribute), original in self.originals.items():
+            setattr(cls, attribute, original)
+        self.originals = {}
+        for gs in list(self.states):
+            gs.bindMoveFunctions()
+        self.states.clear()
+
+    @contextmanager
+    def profiling(self, *states):
+        self.enable(*states)
+        try:
+            yield self
+        finally:
+            self.disable()
+
+    '''
+    {label, elapsed, moveAllocations, functions: {name: {calls, totalSeconds, selfSeconds, meanMicros}}},
+    functions ordered by self time
+    '''
+    def stats(self):
+        functions = {}
+        for name in sorted(self.calls, key=self.selfTime.get, reverse=True):
+            functions[name] = {
+                'calls': self.calls[name],
+                'totalSeconds': self.totalTime[name],
+                'selfSeconds': self.selfTime[name],
+                'meanMicros': self.totalTime[name] / self.calls[name] * 1e6,
+            }
+        return {'label': self.label, 'elapsed': self.elapsed, 'moveAllocations': self.calls.get(MOVE_INIT, 0),
+                'functions': functions}
+
+    def writeJson(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.stats(), file, indent=2)
+
+    '''
+    One "label;caller;callee <self microseconds>" line per call stack, the input format of flamegraph.pl
+    '''
+    def writeFolded(self, path):
+        with open(path, 'w') as file:
+            for stack in sorted(self.stackTime):
+                micros = round(self.stackTime[stack] * 1e6)
+                if micros:
+                    file.write(f"{stack} {micros}\n")
+
+    def __str__(self):
+        lines = [f"{self.label}: {self.elapsed:.3f}s, {self.calls.get(MOVE_INIT, 0)} moves allocated",
+                 f"{'function':<24}{'calls':>10}{'total s':>10}{'self s':>10}{'mean us':>10}"]
+        for name, entry in self.stats()['functions'].items():
+            lines.append(f"{name:<24}{entry['calls']:>10}{entry['totalSeconds']:>10.3f}{entry['selfSeconds']:>10.3f}"
+                         f"{entry['meanMicros']:>10.2f}")
+        return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile move generation on one position")
+    parser.add_argument('--fen', default=Fen.STARTING_FEN)
+    parser.add_argument('--perft', type=int, default=0, help="run perft to this depth")
+    parser.add_argument('--search', type=int, default=0, help="search to this depth")
+    parser.add_argument('--label', default='engine', help="root frame of the folded stacks")
+    parser.add_argument('--json', help="write the stats to this file")
+    parser.add_argument('--folded', help="write folded stacks to this file")
+    args = parser.parse_args(argv)
+    if not args.perft and not args.search:
+        parser.error("give --perft or --search")
+    gs = ChessEngine.GameState.fromFen(args.fen)
+    profiler = Profiler(args.label)
+    with profiler.profiling(gs):
+        if args.perft:
+            gs.perft(args.perft)
+        if args.search:
+            Search(gs, args.search).search()
+    print(profiler)
+    if args.json:
+        profiler.writeJson(args.json)
+    if args.folded:
+        profiler.writeFolded(args.folded)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
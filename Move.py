@@ -1,37 +1,111 @@
+'''A move is a 16-bit code: start square (bits 0-5), end square (bits 6-11) and flags (bits 12-15), with squares
+numbered row * 8 + col. Move wraps the code in a __slots__ object that also keeps the squares and pieces involved,
+so the engine and UI can read them as attributes without per-instance dicts'''
+
+SQUARE_MASK = 0x3F
+FLAGS_SHIFT = 12
+# flags, stored in bits 12-15
+CASTLE_FLAG = 1
+ENPASSANT_FLAG = 2
+PROMOTION_FLAG = 4 # the low two bits then hold the index into Move.promotionPieces
+
 class Move():
+    __slots__ = ('packed', 'startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured')
 
     ranksToRows = {'1': 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {value : key for key, value in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {value: key for key, value in filesToCols.items()}
+    squareNames = tuple(file + rank for rank in "87654321" for file in "abcdefgh")
+
+    promotionPieces = ('Q', 'R', 'B', 'N')
 
-    def __init__(self, startSquare, endSquare, board, isEnpassant = False, isCastle= False):
-        self.startRow = startSquare[0]
-        self.startCol = startSquare[1]
-        self.endRow = endSquare[0]
-        self.endCol = endSquare[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isCastle = isCastle
-        self.isPawnPromotion = False
-        if(self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7):
-            self.isPawnPromotion = True
-        
-        self.isEnpassant = isEnpassant
-        if self.isEnpassant:
-            self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    def __init__(self, startSquare, endSquare, board, isEnpassant = False, isCastle= False, promotionPiece = 'Q'):
+        self.startRow = startRow = startSquare[0]
+        self.startCol = startCol = startSquare[1]
+        self.endRow = endRow = endSquare[0]
+        self.endCol = endCol = endSquare[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        packed = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
+        if isEnpassant:
+            self.pieceCaptured = 'bp' if pieceMoved == 'wp' else 'wp'
+            packed |= ENPASSANT_FLAG << FLAGS_SHIFT
+        else:
+            self.pieceCaptured = board[endRow][endCol]
+            if isCastle:
+                packed |= CASTLE_FLAG << FLAGS_SHIFT
+            elif (pieceMoved == 'wp' and endRow == 0) or (pieceMoved == 'bp' and endRow == 7):
+                packed |= (PROMOTION_FLAG | self.promotionPieces.index(promotionPiece)) << FLAGS_SHIFT
+        self.packed = packed
+
+    '''
+    Rebuild a move from its 16-bit code on the board it was generated for
+    '''
+    @classmethod
+    def fromPacked(cls, packed, board):
+        start = packed & SQUARE_MASK
+        end = (packed >> 6) & SQUARE_MASK
+        flags = packed >> FLAGS_SHIFT
+        return cls(divmod(start, 8), divmod(end, 8), board, isEnpassant=flags == ENPASSANT_FLAG,
+                   isCastle=flags == CASTLE_FLAG, promotionPiece=Move.promotionPieces[flags & 3])
+
+    '''
+    Build a move from its 16-bit code and the pieces it moves and captures, for generators that know them
+    without looking at a board
+    '''
+    @classmethod
+    def fromParts(cls, packed, pieceMoved, pieceCaptured):
+        move = object.__new__(cls)
+        move.packed = packed
+        move.startRow = (packed >> 3) & 7
+        move.startCol = packed & 7
+        move.endRow = (packed >> 9) & 7
+        move.endCol = (packed >> 6) & 7
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = pieceCaptured
+        return move
+
+    @property
+    def isCastle(self):
+        return self.packed >> FLAGS_SHIFT == CASTLE_FLAG
+
+    @property
+    def isEnpassant(self):
+        return self.packed >> FLAGS_SHIFT == ENPASSANT_FLAG
+
+    @property
+    def isPawnPromotion(self):
+        return self.packed >> FLAGS_SHIFT & PROMOTION_FLAG != 0
+
+    @property
+    def promotionPiece(self):
+        flags = self.packed >> FLAGS_SHIFT
+        return self.promotionPieces[flags & 3] if flags & PROMOTION_FLAG else None
+
+    @property
+    def moveID(self):
+        return self.packed
 
     '''
     Overriding equals method
     '''
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            return self.packed == other.packed
         return False
 
+    def __hash__(self):
+        return self.packed
+
+    def __repr__(self):
+        return f"Move({self.getChessNotation()})"
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
-    
+        packed = self.packed
+        notation = self.squareNames[packed & SQUARE_MASK] + self.squareNames[(packed >> 6) & SQUARE_MASK]
+        if packed >> FLAGS_SHIFT & PROMOTION_FLAG:
+            notation += self.promotionPieces[(packed >> FLAGS_SHIFT) & 3].lower()
+        return notation
+
     def getRankFile(self, row, col):
         return self.colsToFiles[col] + self.rowsToRanks[row]
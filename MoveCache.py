@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+'''Bounded LRU cache of legal move lists keyed by zobrist key. The key covers the pieces, side to move, castle
+rights and en passant square, which is everything the legal moves depend on, so stepping back and forth through a
+game or reaching a transposition again reuses the moves generated the first time'''
+
+class MoveCache():
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = OrderedDict() # zobrist key -> (moves, inCheck, checkMate, staleMate), oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    '''
+    Legal moves of the position, like gs.getValidMovesAdvanced(), which also sets gs.inCheck, gs.checkMate
+    and gs.staleMate. The list is the caller's to modify
+    '''
+    def getValidMoves(self, gs):
+        key = gs.zobristKey
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            moves, gs.inCheck, gs.checkMate, gs.staleMate = entry
+            return list(moves)
+        self.misses += 1
+        moves = gs.getValidMovesAdvanced()
+        self.entries[key] = (tuple(moves), gs.inCheck, gs.checkMate, gs.staleMate)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+        return moves
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    Fraction of lookups answered from the cache
+    '''
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return f"{len(self.entries)}/{self.maxSize} positions, {self.hits} hits, {self.misses} misses"
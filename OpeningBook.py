@@ -0,0 +1,157 @@
+'''Opening book. buildBook replays the opening plies of PGN games and writes a binary file of fixed-size
+(zobrist key, packed move, weight, learn) entries sorted by key. OpeningBook memory-maps that file and answers a
+lookup with a binary search over the map, so nothing is loaded into Python objects and every process using the
+same book shares one copy through the page cache'''
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import ChessEngine
+import Pgn
+from Move import Move, SQUARE_MASK
+
+# big-endian, so entries sorted by key are also sorted byte-wise
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+MAX_WEIGHT = 0xFFFF
+# points for the side that played the move, by game result
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}
+
+'''
+Build a book file from the first maxPly plies of every game in a PGN file. A move's weight is the points its
+side scored with it (2 for a win, 1 for a draw); moves seen fewer than minCount times are left out.
+Returns the number of entries written
+'''
+def buildBook(pgnPath, bookPath, maxPly=20, minCount=1):
+    weights = {}
+    counts = {}
+    for game in Pgn.readGames(pgnPath):
+        points = RESULT_POINTS.get(game.result, (1, 1))
+        fen = game.headers.get('FEN')
+        gs = ChessEngine.GameState.fromFen(fen) if fen else ChessEngine.GameState()
+        try:
+            for san in game.sanMoves[:maxPly]:
+                move = Pgn.sanToMove(gs, san, gs.getValidMovesAdvanced())
+                entry = (gs.zobristKey, move.packed)
+                weights[entry] = weights.get(entry, 0) + points[0 if gs.whiteToMove else 1]
+                counts[entry] = counts.get(entry, 0) + 1
+                gs.makeMove(move)
+        except ValueError:
+            continue # keep the plies read before the bad move
+    entries = sorted(entry for entry in weights if counts[entry] >= minCount)
+    with open(bookPath, 'wb') as file:
+        for key, packed in entries:
+            file.write(ENTRY.pack(key, packed, min(weights[key, packed], MAX_WEIGHT), 0))
+    return len(entries)
+
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // ENTRY.size
+
+    def close(self):
+        if self.count:
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    '''
+    Index of the first entry whose key is not below key
+    '''
+    def lowerBound(self, key):
+        mm = self.mm
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(mm, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    '''
+    (packed move, weight, learn) of every entry for the zobrist key
+    '''
+    def probe(self, key):
+        entries = []
+        index = self.lowerBound(key)
+        while index < self.count:
+            entryKey, packed, weight, learn = ENTRY.unpack_from(self.mm, index * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((packed, weight, learn))
+            index += 1
+        return entries
+
+    '''
+    (packed move, weight) of the book moves of the position. Moves that don't fit the board, e.g. after a key
+    collision, are dropped
+    '''
+    def probePosition(self, gs):
+        board = gs.board
+        color = 'w' if gs.whiteToMove else 'b'
+        entries = []
+        for packed, weight, learn in self.probe(gs.zobristKey):
+            start = packed & SQUARE_MASK
+            end = (packed >> 6) & SQUARE_MASK
+            if board[start >> 3][start & 7][0] == color and board[end >> 3][end & 7][0] != color:
+                entries.append((packed, weight))
+        return entries
+
+    '''
+    Book moves of the position as (Move, weight)
+    '''
+    def getMoves(self, gs):
+        return [(Move.fromPacked(packed, gs.board), weight) for packed, weight in self.probePosition(gs)]
+
+    '''
+    A book move for the position, or None when it is out of book. With rng (a random.Random) moves are picked in
+    proportion to their weight, otherwise the heaviest move is played. The chosen move must be among the legal
+    moves, a key collision or a corrupt book can give one that isn't, and then the position counts as out of book
+    '''
+    def pickMove(self, gs, rng=None):
+        entries = self.probePosition(gs)
+        if not entries:
+            return None
+        if rng is None:
+            packed = max(entries, key=lambda entry: entry[1])[0]
+        else:
+            total = sum(weight for packed, weight in entries)
+            if total == 0:
+                packed = rng.choice(entries)[0]
+            else:
+                point = rng.randrange(total)
+                for packed, weight in entries:
+                    point -= weight
+                    if point < 0:
+                        break
+        for move in gs.getValidMovesAdvanced():
+            if move.packed == packed:
+                return move
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from a PGN file")
+    parser.add_argument('pgn', help="PGN file to read")
+    parser.add_argument('book', help="book file to write")
+    parser.add_argument('--plies', type=int, default=20, help="plies of each game to add (default 20)")
+    parser.add_argument('--min-count', type=int, default=1, help="drop moves played fewer times (default 1)")
+    args = parser.parse_args(argv)
+    entries = buildBook(args.pgn, args.book, args.plies, args.min_count)
+    print(f"{entries} entries written to {args.book}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+'''Root-split parallel perft and search. The moves at the root (and for perft optionally one ply deeper) are handed
+out to a ProcessPoolExecutor as tasks, on a pool the caller passes in or one made for the call. A task is a compact
+position: the root FEN plus the packed 16-bit codes of the moves leading to the subtree, so no GameState (and its
+bound-method dicts) is ever pickled. Results are merged
+in root move order, so the answer doesn't depend on which worker finishes first'''
+
+import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import BitboardEngine
+from Move import Move
+from Search import Search, SearchResult, MATE_SCORE, INFINITY, MAX_PLY
+from Evaluation import mvvLva
+
+SHALLOW_DEPTH = 2 # depth of the serial search that the parallel iterations start from
+
+'''
+GameState of the given backend at the root FEN with the packed moves played on it
+'''
+def replayPosition(fen, packedMoves, bitboards=False):
+    engine = BitboardEngine if bitboards else ChessEngine
+    gs = engine.GameState.fromFen(fen)
+    for packed in packedMoves:
+        gs.makeMove(Move.fromPacked(packed, gs.board))
+    return gs
+
+'''
+Packed move paths to every position splitDepth plies below gs. Lines ending in mate or stalemate before that
+have no leaves to count and are left out
+'''
+def splitPaths(gs, splitDepth):
+    if splitDepth == 0:
+        return [()]
+    paths = []
+    for move in gs.getValidMovesAdvanced():
+        gs.makeMove(move)
+        paths.extend((move.packed,) + path for path in splitPaths(gs, splitDepth - 1))
+        gs.undoMove()
+    return paths
+
+'''
+Context manager giving the executor to submit tasks to: the caller's, left open for its next call, or a new
+ProcessPoolExecutor that is shut down on exit
+'''
+def _executor(executor, processes):
+    if executor is not None:
+        return nullcontext(executor)
+    return ProcessPoolExecutor(max_workers=processes or os.cpu_count())
+
+def _perftTask(fen, packedMoves, depth, bitboards):
+    gs = replayPosition(fen, packedMoves, bitboards)
+    remaining = depth - len(packedMoves)
+    return gs.perft(remaining) if remaining > 0 else 1
+
+'''
+Perft of a FEN position with the subtrees below splitDepth plies farmed out to processes worker processes.
+Returns (total nodes, {root move notation: nodes}) like GameState.divide. executor, if given, runs the tasks
+instead of a pool made for this call
+'''
+def parallelPerft(fen, depth, processes=None, splitDepth=1, bitboards=False, executor=None):
+    gs = replayPosition(fen, (), bitboards)
+    if depth == 0:
+        return 1, {}
+    splitDepth = max(1, min(splitDepth, depth))
+    paths = splitPaths(gs, splitDepth)
+    names = {}
+    for move in gs.getValidMovesAdvanced():
+        names[move.packed] = move.getChessNotation()
+    counts = {name: 0 for name in names.values()}
+    with _executor(executor, processes) as pool:
+        futures = [pool.submit(_perftTask, fen, path, depth, bitboards) for path in paths]
+        for path, future in zip(paths, futures):
+            counts[names[path[0]]] += future.result()
+    return sum(counts.values()), counts
+
+'''
+Search one root move to depth, within the nodeLimit and the shared deadline (a time.time() value, the same clock in
+every process), scoring it against alpha: a score at or below alpha only says the move is no better than that.
+Returns (score, packed pv after the move, nodes searched); the score is None if the budget ran out first
+'''
+def _searchTask(fen, packedMove, bitboards, depth, deadline, nodeLimit, alpha):
+    gs = replayPosition(fen, (), bitboards)
+    move = Move.fromPacked(packedMove, gs.board)
+    timeLimit = max(0.0, deadline - time.time()) if deadline is not None else None
+    search = Search(gs, depth, timeLimit, nodeLimit)
+    search.startClock()
+    score, bestMove, pv = search.searchRoot([move], depth, alpha)
+    if search.stopped:
+        return None, [], search.nodes
+    return score, [reply.packed for reply in pv[1:]], search.nodes
+
+'''
+Search a FEN position by iterative deepening with the root moves of every iteration searched in their own tasks.
+A serial search to SHALLOW_DEPTH comes first. After it, every iteration searches the best move so far first with an
+open window, and the others only against the score of the iteration before, which is enough to show they are no
+better and prunes like a serial search does behind the first move. Should the best move's score drop below that,
+the moves that failed low are searched again against the best score of this iteration.
+
+The budget is for the whole search: every task stops at one deadline timeLimit seconds from now, and what is left
+of nodeLimit is shared out in proportion to the nodes each root move took the iteration before, evenly at first,
+with the moves that ran out of their share searched again on what the others left over. An iteration counts only if
+every root move finished it, otherwise the result is that of the previous one, and like Search no iteration is
+started after half the time is gone. executor, if given, runs the tasks instead of a pool made for this call.
+Returns a SearchResult
+'''
+def parallelSearch(fen, maxDepth, timeLimit=None, nodeLimit=None, processes=None, bitboards=False, executor=None):
+    deadline = time.time() + timeLimit if timeLimit is not None else None
+    start = time.perf_counter()
+    gs = replayPosition(fen, (), bitboards)
+    maxDepth = min(maxDepth, MAX_PLY)
+    result = Search(gs, min(maxDepth, SHALLOW_DEPTH), timeLimit, nodeLimit).search()
+    if result.depth < SHALLOW_DEPTH or abs(result.score) >= MATE_SCORE - MAX_PLY:
+        return result # out of budget, or a forced mate (also when there are no moves)
+    rootMoves = gs.getValidMovesAdvanced()
+    rootMoves.sort(key=mvvLva, reverse=True)
+    nodes = result.nodes
+    # root move -> nodes its last task took, the guess at how the budget should be shared out next iteration
+    weights = dict.fromkeys(rootMoves, 1)
+
+    with _executor(executor, processes) as pool:
+        for depth in range(SHALLOW_DEPTH + 1, maxDepth + 1):
+            if deadline is not None and time.perf_counter() - start > timeLimit / 2:
+                break
+            if nodeLimit is not None and nodes >= nodeLimit:
+                break
+            rootMoves.remove(result.bestMove)
+            rootMoves.insert(0, result.bestMove)
+            # root move -> the alpha it was searched against
+            bounds = dict.fromkeys(rootMoves, result.score)
+            bounds[result.bestMove] = -INFINITY
+            scores = {}
+            pending = rootMoves
+            while pending:
+                taskNodes = dict.fromkeys(pending)
+                if nodeLimit is not None:
+                    total = sum(weights[move] for move in pending)
+                    for move in pending:
+                        taskNodes[move] = max(1, (nodeLimit - nodes) * weights[move] // total)
+                futures = [pool.submit(_searchTask, fen, move.packed, bitboards, depth, deadline, taskNodes[move],
+                                       bounds[move]) for move in pending]
+                for move, future in zip(pending, futures):
+                    score, packedPv, moveNodes = future.result()
+                    scores[move] = (score, packedPv)
+                    weights[move] = max(1, moveNodes)
+                    nodes += moveNodes
+                unfinished = [move for move in pending if scores[move][0] is None]
+                if unfinished:
+                    # moves that went over their share get another go with what the others left, while that helps
+                    if len(unfinished) == len(pending) or deadline is not None and time.time() >= deadline or \
+                            nodeLimit is not None and nodes >= nodeLimit:
+                        break
+                    pending = unfinished
+                    continue
+                # a score at or below its bound is only an upper bound, fine as long as the best exact score (the
+                # first move's at least) is as high. The others are searched again against that score
+                bestScore = max(scores[move][0] for move in rootMoves if scores[move][0] > bounds[move])
+                pending = [move for move in rootMoves if scores[move][0] <= bounds[move] and bounds[move] > bestScore]
+                for move in pending:
+                    bounds[move] = bestScore
+            if pending:
+                break # the budget ran out before every root move finished this iteration
+
+            # ties go to the move searched first
+            bestMove = max((move for move in rootMoves if scores[move][0] > bounds[move]),
+                           key=lambda move: (scores[move][0], -rootMoves.index(move)))
+            score, packedPv = scores[bestMove]
+            pv = [bestMove]
+            gs.makeMove(bestMove)
+            for packed in packedPv:
+                pv.append(Move.fromPacked(packed, gs.board))
+                gs.makeMove(pv[-1])
+            for move in pv:
+                gs.undoMove()
+            result = SearchResult(bestMove, score, pv, depth, nodes, 0)
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break # found a forced mate, deeper search will not change it
+
+    result.nodes = nodes
+    result.elapsed = time.perf_counter() - start
+    result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+    return result
@@ -0,0 +1,81 @@
+'''Perft runner. Counts the legal move tree of reference positions with known node counts, so regressions in
+makeMove/undoMove and move generation show up as wrong counts, and reports nodes/sec for each depth'''
+
+import argparse
+import sys
+import time
+import ChessEngine
+import BitboardEngine
+import Parallel
+
+# name -> (FEN, node counts for depth 1, 2, ...)
+REFERENCE_POSITIONS = {
+    'startpos': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                 (20, 400, 8902, 197281, 4865609)),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 (48, 2039, 97862, 4085603)),
+    'endgame': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                (14, 191, 2812, 43238, 674624)),
+    'promotions': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                   (6, 264, 9467, 422333)),
+    'discovered': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                   (44, 1486, 62379, 2103487)),
+    'middlegame': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                   (46, 2079, 89890, 3894594)),
+}
+
+'''
+Run perft on one position for depths 1..maxDepth and print nodes, nodes/sec and whether the count matches.
+Returns True if every count with a known reference matched
+'''
+def runPosition(engine, name, fen, expected, maxDepth, processes=None):
+    print(f"{name}: {fen}")
+    passed = True
+    for depth in range(1, maxDepth + 1):
+        start = time.perf_counter()
+        if processes:
+            nodes = Parallel.parallelPerft(fen, depth, processes, bitboards=engine is BitboardEngine)[0]
+        else:
+            nodes = engine.GameState.fromFen(fen).perft(depth)
+        elapsed = time.perf_counter() - start
+        nps = int(nodes / elapsed) if elapsed > 0 else 0
+        if depth <= len(expected):
+            status = "ok" if nodes == expected[depth - 1] else f"FAIL (expected {expected[depth - 1]})"
+            passed = passed and nodes == expected[depth - 1]
+        else:
+            status = "no reference"
+        print(f"  depth {depth}: {nodes} nodes in {elapsed:.3f}s, {nps} nodes/sec {status}")
+    return passed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft correctness and throughput check")
+    parser.add_argument('--depth', type=int, default=3, help="maximum depth to search (default 3)")
+    parser.add_argument('--position', choices=sorted(REFERENCE_POSITIONS), action='append',
+                        help="reference position to run, can be repeated (default all)")
+    parser.add_argument('--fen', help="run a custom position instead of the reference suite")
+    parser.add_argument('--divide', action='store_true', help="print node counts per root move at --depth")
+    parser.add_argument('--bitboards', action='store_true', help="use the bitboard backend")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="split the root moves across this many worker processes (default: no split)")
+    args = parser.parse_args(argv)
+    engine = BitboardEngine if args.bitboards else ChessEngine
+
+    if args.divide:
+        fen = args.fen or REFERENCE_POSITIONS[(args.position or ['startpos'])[0]][0]
+        counts = engine.GameState.fromFen(fen).divide(args.depth)
+        for notation in sorted(counts):
+            print(f"{notation}: {counts[notation]}")
+        print(f"total: {sum(counts.values())}")
+        return 0
+
+    if args.fen:
+        positions = {'custom': (args.fen, ())}
+    else:
+        positions = {name: REFERENCE_POSITIONS[name] for name in (args.position or REFERENCE_POSITIONS)}
+    passed = True
+    for name, (fen, expected) in positions.items():
+        passed = runPosition(engine, name, fen, expected, args.depth, args.processes) and passed
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
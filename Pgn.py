@@ -0,0 +1,235 @@
+'''PGN reading and SAN. Games are streamed out of a memory-mapped file by byte offset, so huge archives are never
+read whole, SAN is matched against getValidMovesAdvanced and each game is replayed on a GameState.
+validateFile shards a file by game offsets across a process pool, so throughput scales with the cores'''
+
+import argparse
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import BitboardEngine
+from Move import Move
+
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, line comments, NAGs, move numbers and results, removed before movetext is split into SAN tokens
+MOVETEXT_NOISE = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(?:\.\.)?|1-0|0-1|1/2-1/2|\*')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+GAME_START = b'\n[Event '
+# games given to a worker at a time by validateFile
+GAMES_PER_TASK = 256
+
+class PgnGame():
+    __slots__ = ('headers', 'sanMoves', 'result')
+
+    def __init__(self, headers, sanMoves, result):
+        self.headers = headers
+        self.sanMoves = sanMoves
+        self.result = result
+
+    def __repr__(self):
+        return f"PgnGame({self.headers.get('White', '?')} - {self.headers.get('Black', '?')}, {len(self.sanMoves)} plies)"
+
+'''
+The valid move written as san in the position gs is in. validMoves are the moves of getValidMovesAdvanced.
+Raises ValueError if no valid move or more than one matches
+'''
+def sanToMove(gs, san, validMoves):
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        kingside = len(text) == 3
+        for move in validMoves:
+            if move.isCastle and (move.endCol > move.startCol) == kingside:
+                return move
+        raise ValueError(f"illegal castle {san!r} in {gs.toFen()}")
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"unreadable SAN {san!r}")
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    piece = piece or 'p'
+    endRow = Move.ranksToRows[target[1]]
+    endCol = Move.filesToCols[target[0]]
+    found = None
+    for move in validMoves:
+        if move.endRow != endRow or move.endCol != endCol or move.pieceMoved[1] != piece or move.isCastle:
+            continue
+        if fromFile is not None and move.startCol != Move.filesToCols[fromFile]:
+            continue
+        if fromRank is not None and move.startRow != Move.ranksToRows[fromRank]:
+            continue
+        if move.isPawnPromotion and move.promotionPiece != (promotion or 'Q'):
+            continue
+        if found is not None:
+            raise ValueError(f"ambiguous SAN {san!r} in {gs.toFen()}")
+        found = move
+    if found is None:
+        raise ValueError(f"illegal SAN {san!r} in {gs.toFen()}")
+    return found
+
+'''
+SAN of a valid move in the position gs is in, with a + or # suffix. validMoves are the moves of
+getValidMovesAdvanced, used to disambiguate between pieces of the same type
+'''
+def moveToSan(gs, move, validMoves):
+    if move.isCastle:
+        san = 'O-O' if move.endCol > move.startCol else 'O-O-O'
+    else:
+        pieceType = move.pieceMoved[1]
+        target = Move.squareNames[move.endRow * 8 + move.endCol]
+        capture = move.pieceCaptured != '--'
+        if pieceType == 'p':
+            san = (Move.colsToFiles[move.startCol] + 'x' if capture else '') + target
+            if move.isPawnPromotion:
+                san += '=' + move.promotionPiece
+        else:
+            others = [other for other in validMoves if other.pieceMoved == move.pieceMoved and
+                      other.endRow == move.endRow and other.endCol == move.endCol and
+                      (other.startRow, other.startCol) != (move.startRow, move.startCol)]
+            disambiguation = ''
+            if others:
+                if all(other.startCol != move.startCol for other in others):
+                    disambiguation = Move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in others):
+                    disambiguation = Move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = Move.colsToFiles[move.startCol] + Move.rowsToRanks[move.startRow]
+            san = pieceType + disambiguation + ('x' if capture else '') + target
+    gs.makeMove(move)
+    kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    if gs.squareUnderAttack(kingRow, kingCol):
+        san += '#' if len(gs.getValidMovesAdvanced()) == 0 else '+'
+    gs.undoMove()
+    return san
+
+'''
+Parse the text of one game into a PgnGame. Variations are dropped
+'''
+def parseGame(text):
+    headers = dict(TAG_PATTERN.findall(text))
+    movetext = TAG_PATTERN.sub(' ', text)
+    # strip comments first so brackets inside them don't count as variations
+    movetext = MOVETEXT_NOISE.sub(lambda match: ' ' + match.group() + ' ' if match.group() in RESULTS else ' ', movetext)
+    tokens = []
+    depth = 0
+    result = headers.get('Result', '*')
+    for token in movetext.replace('(', ' ( ').replace(')', ' ) ').split():
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0:
+            if token in RESULTS:
+                result = token
+            else:
+                tokens.append(token)
+    return PgnGame(headers, tokens, result)
+
+'''
+Byte offsets of the start of every game in a memory-mapped PGN file, taken from its [Event tags
+'''
+def gameOffsets(mm):
+    offsets = []
+    if mm[:7] == GAME_START[1:]:
+        offsets.append(0)
+    position = mm.find(GAME_START)
+    while position != -1:
+        offsets.append(position + 1)
+        position = mm.find(GAME_START, position + 1)
+    return offsets
+
+'''
+Yield every game of a PGN file in order. The file is memory-mapped and decoded one game at a time
+'''
+def readGames(path, start=0, end=None):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if end is None:
+                end = len(mm)
+            position = start
+            while position < end:
+                nextGame = mm.find(GAME_START, position, end)
+                stop = end if nextGame == -1 else nextGame + 1
+                text = mm[position:stop].decode('utf-8', errors='replace')
+                if text.strip():
+                    yield parseGame(text)
+                position = stop
+
+'''
+Play a game's moves on a new GameState of the given engine module, starting from its FEN tag if it has one.
+Returns the final GameState, raises ValueError at the first illegal or unreadable move
+'''
+def replayGame(game, engine=ChessEngine):
+    fen = game.headers.get('FEN')
+    gs = engine.GameState.fromFen(fen) if fen else engine.GameState()
+    for san in game.sanMoves:
+        gs.makeMove(sanToMove(gs, san, gs.getValidMovesAdvanced()))
+    return gs
+
+'''
+Replay the games between two byte offsets of a PGN file.
+Returns (games, plies, errors) where errors lists (game index, error message)
+'''
+def validateRange(path, start, end, firstIndex=0, bitboards=False):
+    engine = BitboardEngine if bitboards else ChessEngine
+    games = plies = 0
+    errors = []
+    for index, game in enumerate(readGames(path, start, end), firstIndex):
+        try:
+            replayGame(game, engine)
+        except ValueError as error:
+            errors.append((index, str(error)))
+        games += 1
+        plies += len(game.sanMoves)
+    return games, plies, errors
+
+'''
+Replay every game in a PGN file. With more than one process the game offsets are split into
+tasks of GAMES_PER_TASK games and handed to a process pool. Returns (games, plies, errors)
+'''
+def validateFile(path, processes=None, bitboards=False):
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return validateRange(path, 0, None, 0, bitboards)
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0, 0, []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = gameOffsets(mm)
+            size = len(mm)
+    if not offsets or offsets[0] != 0:
+        offsets.insert(0, 0)
+    bounds = offsets[::GAMES_PER_TASK] + [size]
+    games = plies = 0
+    errors = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(validateRange, path, bounds[i], bounds[i + 1], i * GAMES_PER_TASK, bitboards)
+                   for i in range(len(bounds) - 1)]
+        for future in futures:
+            taskGames, taskPlies, taskErrors = future.result()
+            games += taskGames
+            plies += taskPlies
+            errors.extend(taskErrors)
+    return games, plies, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate every game in a PGN file")
+    parser.add_argument('path', help="PGN file")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--bitboards', action='store_true', help="use the bitboard backend")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    games, plies, errors = validateFile(args.path, args.processes, args.bitboards)
+    elapsed = time.perf_counter() - start
+    for index, message in errors:
+        print(f"game {index + 1}: {message}")
+    rate = games / elapsed if elapsed > 0 else 0
+    print(f"{games} games, {plies} plies, {len(errors)} errors in {elapsed:.2f}s, {rate:.1f} games/sec")
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
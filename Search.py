@@ -0,0 +1,264 @@
+import time
+from TranspositionTable import EXACT, LOWER, UPPER
+from Tablebase import WIN, LOSS
+from Evaluation import evaluate, mvvLva
+
+'''Alpha-beta search on top of GameState. Negamax with iterative deepening, a principal variation and a
+quiescence search over captures, bounded by a wall-clock and/or node budget. The search always has a move to
+return: when the budget runs out it stops and reports the best move of the deepest completed work'''
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+CHECK_EVERY = 128 # nodes between clock checks, a few milliseconds at the nodes per second of this search
+
+'''
+Mate scores are stored relative to the node rather than the root, so they stay correct when the position
+is reached at a different ply
+'''
+def scoreToTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+class SearchResult():
+    def __init__(self, bestMove, score, pv, depth, nodes, elapsed):
+        self.bestMove = bestMove
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.nps = int(nodes / elapsed) if elapsed > 0 else 0
+
+    def __str__(self) -> str:
+        pv = " ".join(move.getChessNotation() for move in self.pv)
+        return f"depth {self.depth} score {self.score} nodes {self.nodes} nps {self.nps} pv {pv}"
+
+class Search():
+    def __init__(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, infoCallback=None, tt=None, book=None,
+                 tablebase=None):
+        self.gs = gs
+        self.tt = tt # optional TranspositionTable shared between searches
+        self.book = book # optional OpeningBook, consulted before searching
+        self.tablebase = tablebase # optional Tablebase, probed instead of searching positions it covers
+        self.maxDepth = min(maxDepth, MAX_PLY)
+        self.timeLimit = timeLimit # seconds, or None for no limit
+        self.nodeLimit = nodeLimit
+        self.infoCallback = infoCallback # called with a SearchResult after every completed iteration
+        self.nodes = 0
+        self.stopped = False
+        self.stopRequested = False # set by stop(), possibly from another thread
+        self.startTime = 0
+        self.deadline = None
+        self.pvTable = [[] for ply in range(MAX_PLY + 1)]
+
+    '''
+    Run iterative deepening until maxDepth or the budget is exhausted. Returns a SearchResult; bestMove is None
+    only if the side to move has no legal moves. A book move is returned right away with depth 0
+    '''
+    def search(self):
+        gs = self.gs
+        if self.book is not None:
+            bookMove = self.book.pickMove(gs)
+            if bookMove is not None:
+                return SearchResult(bookMove, 0, [bookMove], 0, 0, 0)
+        savedFlags = (gs.checkMate, gs.staleMate, gs.inCheck)
+        self.startClock()
+        if self.tt is not None:
+            self.tt.newSearch()
+
+        rootMoves = gs.getValidMovesAdvanced()
+        if len(rootMoves) == 0:
+            score = -MATE_SCORE if gs.inCheck else 0
+            return SearchResult(None, score, [], 0, 0, 0)
+        rootMoves.sort(key=mvvLva, reverse=True)
+        result = SearchResult(rootMoves[0], 0, [rootMoves[0]], 0, 0, 0)
+
+        for depth in range(1, self.maxDepth + 1):
+            score, bestMove, pv = self.searchRoot(rootMoves, depth)
+            elapsed = time.perf_counter() - self.startTime
+            if bestMove is not None:
+                # a partial iteration still searched the previous best move first, so anything it prefers is better
+                result = SearchResult(bestMove, score, pv, depth, self.nodes, elapsed)
+            if self.stopped:
+                break
+            if self.infoCallback is not None:
+                self.infoCallback(result)
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break # found a forced mate, deeper search will not change it
+            # the next iteration takes several times longer than this one, don't start what can't finish
+            if self.deadline is not None and elapsed > self.timeLimit / 2:
+                break
+            # search the best move first on the next iteration
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+
+        gs.checkMate, gs.staleMate, gs.inCheck = savedFlags
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - self.startTime
+        result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    '''
+    Reset the node count and start the time budget
+    '''
+    def startClock(self):
+        self.nodes = 0
+        self.stopped = False
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + self.timeLimit if self.timeLimit is not None else None
+
+    '''
+    Search every root move to depth. Returns (score, best move, pv); the move is None if the budget ran out
+    before the first root move finished, or if no move scored above alpha, in which case the score is alpha
+    '''
+    def searchRoot(self, rootMoves, depth, alpha=-INFINITY):
+        gs = self.gs
+        beta = INFINITY
+        bestMove = None
+        bestPv = []
+        for move in rootMoves:
+            gs.makeMove(move)
+            score = -self.negamax(depth - 1, 1, -beta, -alpha)
+            gs.undoMove()
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha = score
+                bestMove = move
+                bestPv = [move] + self.pvTable[1]
+        return alpha, bestMove, bestPv
+
+    '''
+    Fail-hard negamax alpha-beta. Fills pvTable[ply] with the principal variation from this node
+    '''
+    def negamax(self, depth, ply, alpha, beta):
+        self.pvTable[ply] = []
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(ply, alpha, beta)
+        self.countNode()
+        if self.stopped:
+            return 0
+
+        gs = self.gs
+        if ply > 0 and (gs.isRepetition() or gs.canClaimFiftyMoves()):
+            # a repetition inside the tree is scored as the draw it leads to
+            return 0
+        tablebase = self.tablebase
+        if tablebase is not None and gs.pieceCount() <= tablebase.maxPieces:
+            entry = tablebase.probe(gs)
+            if entry is not None:
+                result, plies = entry
+                if result == WIN:
+                    return min(MATE_SCORE - ply - plies, beta)
+                if result == LOSS:
+                    return max(-MATE_SCORE + ply + plies, alpha)
+                return min(max(0, alpha), beta)
+        tt = self.tt
+        ttMove = 0
+        if tt is not None:
+            entry = tt.probe(gs.zobristKey)
+            if entry is not None:
+                ttDepth, bound, ttScore, ttMove = entry
+                if ttDepth >= depth:
+                    ttScore = scoreFromTable(ttScore, ply)
+                    if bound == LOWER and ttScore >= beta:
+                        return beta
+                    if bound == UPPER and ttScore <= alpha:
+                        return alpha
+                    if bound == EXACT:
+                        return min(max(ttScore, alpha), beta)
+
+        # moves come a stage at a time, so a cutoff on the hash move or a capture never builds the quiet moves
+        bound = UPPER
+        bestMove = 0
+        searched = 0
+        for move in gs.generateMovesStaged(ttMove):
+            searched += 1
+            gs.makeMove(move)
+            score = -self.negamax(depth - 1, ply + 1, -beta, -alpha)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score >= beta:
+                if tt is not None:
+                    tt.store(gs.zobristKey, depth, LOWER, scoreToTable(beta, ply), move.packed)
+                return beta
+            if score > alpha:
+                alpha = score
+                bound = EXACT
+                bestMove = move.packed
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+        if searched == 0:
+            return -MATE_SCORE + ply if gs.inCheck else 0
+        if tt is not None:
+            tt.store(gs.zobristKey, depth, bound, scoreToTable(alpha, ply), bestMove)
+        return alpha
+
+    '''
+    Search captures (and check evasions) until the position is quiet, so the static evaluation is never taken
+    in the middle of an exchange
+    '''
+    def quiescence(self, ply, alpha, beta):
+        self.pvTable[ply] = []
+        self.countNode()
+        if self.stopped:
+            return 0
+
+        gs = self.gs
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+        if gs.squareUnderAttack(kingRow, kingCol):
+            # every evasion counts in check, not just the captures
+            moves = list(gs.generateMovesStaged())
+            if len(moves) == 0:
+                return -MATE_SCORE + ply
+        else:
+            # a stand pat cutoff doesn't need any moves generated
+            standPat = evaluate(gs)
+            if standPat >= beta:
+                return beta
+            if standPat > alpha:
+                alpha = standPat
+            moves = gs.getCaptureMoves()
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.quiescence(ply + 1, -beta, -alpha)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+        return alpha
+
+    '''
+    Ask a running search to finish. It stops at the next node and still returns the best move found so far
+    '''
+    def stop(self):
+        self.stopRequested = True
+
+    '''
+    Count a node and stop the search once the node or time budget is used up or a stop was requested
+    '''
+    def countNode(self):
+        self.nodes += 1
+        if self.stopRequested:
+            self.stopped = True
+        elif self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+        elif self.deadline is not None and self.nodes % CHECK_EVERY == 0 and time.perf_counter() >= self.deadline:
+            self.stopped = True
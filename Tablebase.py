@@ -0,0 +1,456 @@
+'''Endgame tablebases. generateTable builds the table of one material signature such as "KQvK" or "KPvK" by
+retrograde analysis: every position is set up once on a GameState to collect its successors, then values are
+propagated backward from the checkmates, one ply at a time, giving win/draw/loss and distance to mate in plies.
+Tables for the material reached by captures and promotions are generated first and probed for those moves.
+
+The file holds one code per position, bit-packed with as few bits as the longest mate needs, at an index
+computed straight from the piece squares: the white king is moved into a1-d1-d4 (a-d files with pawns) by the
+board's symmetries, then the other pieces' squares and the side to move follow. Tablebase memory-maps the files,
+so a probe is one index computation and one read. Positions with castle rights are not covered; en passant
+possibilities are ignored.
+
+Generation is limited to MAX_PIECES pieces. A 3-piece table has 82k-262k positions and takes 15-30 seconds and
+some 35 MB. Every further piece multiplies the positions by 64 (identical pieces are indexed separately, so their
+swapped placements are stored twice) and the generator keeps every move between them in memory: a 4-piece table
+would take from about 20 minutes and 500 MB without pawns to over an hour and several GB with them'''
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+import ChessEngine
+from AttackTables import KING_ATTACKS
+
+MAGIC = b'PCTB'
+# magic, bits per entry, flags (1: table has pawns), signature, number of entries
+HEADER = struct.Struct('<4sBB16sI')
+HAS_PAWNS = 1
+# a code c > 0 means mate in c - 1 plies with best play, won for the side to move when c - 1 is odd.
+# 0 is a draw, or an illegal position
+DRAW = 0
+WIN = 1
+LOSS = -1
+# pieces of a side in signature order, and their values for choosing the stronger side
+PIECE_ORDER = 'KQRBNP'
+PIECE_VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+TABLE_EXTENSION = '.tb'
+MAX_PIECES = 3 # most pieces, kings included, that generateTable builds tables for
+
+'''
+The 8 symmetries of the board as tuples mapping square number row * 8 + col to its image
+'''
+def _transforms():
+    transforms = []
+    for swap in (False, True):
+        for flipRow in (False, True):
+            for flipCol in (False, True):
+                table = []
+                for sq in range(64):
+                    row, col = divmod(sq, 8)
+                    if swap:
+                        row, col = col, row
+                    if flipRow:
+                        row = 7 - row
+                    if flipCol:
+                        col = 7 - col
+                    table.append(row * 8 + col)
+                transforms.append(tuple(table))
+    return transforms
+
+TRANSFORMS = _transforms()
+MIRROR_FILES = TRANSFORMS[1] # col -> 7 - col, the only symmetry left when pawns can only move one way
+MIRROR_RANKS = TRANSFORMS[2] # row -> 7 - row, used to swap colors
+
+'''
+For each white king square: the transform that brings it into the reduced king region and its slot there
+'''
+def _kingSlots(transforms, inRegion):
+    regionSquares = [sq for sq in range(64) if inRegion(sq)]
+    slots = {sq: i for i, sq in enumerate(regionSquares)}
+    kingTransform = []
+    for sq in range(64):
+        for t, transform in enumerate(transforms):
+            if transform[sq] in slots:
+                kingTransform.append(t)
+                break
+    return regionSquares, slots, kingTransform
+
+# pawnless tables: the a1-d1-d4 triangle (row 7 is the first rank)
+TRIANGLE, TRIANGLE_SLOTS, TRIANGLE_TRANSFORM = _kingSlots(
+    TRANSFORMS, lambda sq: sq >> 3 >= 4 and (sq & 7) <= 3 and 7 - (sq >> 3) <= (sq & 7))
+# tables with pawns: files a-d
+HALF_BOARD, HALF_BOARD_SLOTS, HALF_BOARD_TRANSFORM = _kingSlots(
+    (TRANSFORMS[0], MIRROR_FILES), lambda sq: (sq & 7) <= 3)
+
+'''
+Split a signature like "KRvKP" into the white and black piece letters, in signature order
+'''
+def parseSignature(signature):
+    white, _, black = signature.upper().partition('V')
+    if white.count('K') != 1 or black.count('K') != 1 or any(char not in PIECE_ORDER for char in white + black):
+        raise ValueError(f"bad material signature {signature!r}")
+    return sortPieces(white), sortPieces(black)
+
+def sortPieces(pieces):
+    return ''.join(sorted(pieces, key=PIECE_ORDER.index))
+
+'''
+Canonical signature of the material, stronger side first, and whether the colors had to be swapped for it
+'''
+def canonicalSignature(white, black):
+    white, black = sortPieces(white), sortPieces(black)
+    whiteKey = (sum(PIECE_VALUES[piece] for piece in white), len(white), [-PIECE_ORDER.index(p) for p in white])
+    blackKey = (sum(PIECE_VALUES[piece] for piece in black), len(black), [-PIECE_ORDER.index(p) for p in black])
+    if blackKey > whiteKey:
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+'''
+Indexing of the positions of one signature. Pieces are kept in the order white king, black king, then the
+other white and black pieces in signature order
+'''
+class TableLayout():
+    def __init__(self, signature):
+        white, black = parseSignature(signature)
+        self.signature = white + 'v' + black
+        self.pieces = ('wK', 'bK') + tuple('w' + p.replace('P', 'p') for p in white[1:]) + \
+            tuple('b' + p.replace('P', 'p') for p in black[1:])
+        self.hasPawns = 'P' in white + black
+        if self.hasPawns:
+            self.kingSquares, self.kingSlots, self.kingTransform = HALF_BOARD, HALF_BOARD_SLOTS, HALF_BOARD_TRANSFORM
+            self.transforms = (TRANSFORMS[0], MIRROR_FILES)
+        else:
+            self.kingSquares, self.kingSlots, self.kingTransform = TRIANGLE, TRIANGLE_SLOTS, TRIANGLE_TRANSFORM
+            self.transforms = TRANSFORMS
+        self.others = len(self.pieces) - 1
+        self.size = len(self.kingSquares) * 64 ** self.others * 2
+
+    '''
+    Index of the position with the pieces on squares (in self.pieces order) and the given side to move
+    '''
+    def index(self, squares, whiteToMove):
+        transform = self.transforms[self.kingTransform[squares[0]]]
+        index = self.kingSlots[transform[squares[0]]]
+        for sq in squares[1:]:
+            index = index * 64 + transform[sq]
+        return index * 2 + (0 if whiteToMove else 1)
+
+    '''
+    Piece squares and side to move of an index
+    '''
+    def squares(self, index):
+        whiteToMove = index & 1 == 0
+        index >>= 1
+        squares = []
+        for i in range(self.others):
+            squares.append(index & 63)
+            index >>= 6
+        squares.append(self.kingSquares[index])
+        squares.reverse()
+        return squares, whiteToMove
+
+'''
+Squares of the position's pieces in the layout's order, or None if the board holds other material
+'''
+def _layoutSquares(layout, pieceSquares):
+    squares = []
+    seen = {}
+    for piece in layout.pieces:
+        index = seen.get(piece, 0)
+        seen[piece] = index + 1
+        pieceList = pieceSquares.get(piece, ())
+        if index >= len(pieceList):
+            return None
+        squares.append(pieceList[index])
+    return squares
+
+'''
+piece -> list of square numbers of a board
+'''
+def boardPieceSquares(board):
+    pieceSquares = {}
+    for row in range(8):
+        boardRow = board[row]
+        for col in range(8):
+            piece = boardRow[col]
+            if piece != '--':
+                pieceSquares.setdefault(piece, []).append(row * 8 + col)
+    return pieceSquares
+
+'''
+Memory-mapped table file of one signature
+'''
+class TableFile():
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.bits, flags, signature, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tablebase file")
+        self.layout = TableLayout(signature.rstrip(b'\0').decode('ascii'))
+        self.mask = (1 << self.bits) - 1
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def code(self, index):
+        bit = index * self.bits
+        start = HEADER.size + (bit >> 3)
+        return (int.from_bytes(self.mm[start:start + 3], 'little') >> (bit & 7)) & self.mask
+
+'''
+(result, plies to mate) for a code, from the side to move's point of view
+'''
+def decodeCode(code):
+    if code == 0:
+        return DRAW, 0
+    plies = code - 1
+    return (WIN if plies & 1 else LOSS), plies
+
+'''
+Write codes (an array of ints) bit-packed after the header
+'''
+def writeTable(path, layout, codes):
+    bits = max(1, max(codes).bit_length())
+    packed = bytearray(HEADER.pack(MAGIC, bits, HAS_PAWNS if layout.hasPawns else 0,
+                                   layout.signature.encode('ascii'), len(codes)))
+    accumulator = 0
+    filled = 0
+    for code in codes:
+        accumulator |= code << filled
+        filled += bits
+        while filled >= 8:
+            packed.append(accumulator & 255)
+            accumulator >>= 8
+            filled -= 8
+    if filled:
+        packed.append(accumulator)
+    packed.extend(b'\0\0\0') # so a probe can always read three bytes
+    with open(path + '.tmp', 'wb') as file:
+        file.write(packed)
+    os.replace(path + '.tmp', path)
+
+'''
+Tablebase files of a directory, opened on first use and probed by GameState
+'''
+class Tablebase():
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.tables = {}
+        self.maxPieces = 0
+        for name in os.listdir(directory) if os.path.isdir(directory) else ():
+            if name.endswith(TABLE_EXTENSION):
+                self.maxPieces = max(self.maxPieces, len(name) - len(TABLE_EXTENSION) - 1)
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def table(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature + TABLE_EXTENSION)
+            self.tables[signature] = TableFile(path) if os.path.exists(path) else None
+        return self.tables[signature]
+
+    '''
+    (result, plies to mate) of the board for the side to move, result being WIN, DRAW or LOSS. None when there
+    is no table for the material
+    '''
+    def probeBoard(self, board, whiteToMove):
+        pieceSquares = boardPieceSquares(board)
+        if len(pieceSquares.get('wK', ())) != 1 or len(pieceSquares.get('bK', ())) != 1:
+            return None
+        white = ''.join(piece[1].upper() * len(squares) for piece, squares in pieceSquares.items() if piece[0] == 'w')
+        black = ''.join(piece[1].upper() * len(squares) for piece, squares in pieceSquares.items() if piece[0] == 'b')
+        signature, swapped = canonicalSignature(white, black)
+        table = self.table(signature)
+        if table is None:
+            return None
+        if swapped: # look the position up with the colors exchanged and the board turned around
+            pieceSquares = {('b' if piece[0] == 'w' else 'w') + piece[1]: [MIRROR_RANKS[sq] for sq in squares]
+                            for piece, squares in pieceSquares.items()}
+            whiteToMove = not whiteToMove
+        squares = _layoutSquares(table.layout, pieceSquares)
+        return decodeCode(table.code(table.layout.index(squares, whiteToMove)))
+
+    def probe(self, gs):
+        if gs.currentCastleRights:
+            return None
+        return self.probeBoard(gs.board, gs.whiteToMove)
+
+'''
+Signatures of the material that captures and promotions in the signature's positions can lead to
+'''
+def childSignatures(signature):
+    white, black = parseSignature(signature)
+    children = set()
+    for side, other, isWhite in ((white, black, True), (black, white, False)):
+        for i, piece in enumerate(side):
+            if piece == 'K':
+                continue
+            # this piece is captured
+            rest = side[:i] + side[i + 1:]
+            children.add(canonicalSignature(rest, other) if isWhite else canonicalSignature(other, rest))
+            if piece == 'P': # this pawn promotes, possibly while capturing
+                for promoted in 'QRBN':
+                    grown = rest + promoted
+                    for captured in [None] + [j for j, p in enumerate(other) if p != 'K']:
+                        remaining = other if captured is None else other[:captured] + other[captured + 1:]
+                        children.add(canonicalSignature(grown, remaining) if isWhite
+                                     else canonicalSignature(remaining, grown))
+    return sorted(signature for signature, swapped in children if signature != canonicalSignature(white, black)[0])
+
+'''
+Generate the table of a signature into directory, first generating every table it depends on.
+Existing table files are kept. Returns the path of the table. Raises ValueError for more than MAX_PIECES pieces
+'''
+def generateTable(signature, directory='.', verbose=False):
+    white, black = parseSignature(signature)
+    if len(white) + len(black) > MAX_PIECES:
+        raise ValueError(f"{signature}: tables of more than {MAX_PIECES} pieces take too long and too much memory")
+    signature = canonicalSignature(white, black)[0]
+    path = os.path.join(directory, signature + TABLE_EXTENSION)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    for child in childSignatures(signature):
+        generateTable(child, directory, verbose)
+
+    start = time.perf_counter()
+    layout = TableLayout(signature)
+    tablebase = Tablebase(directory)
+    size = layout.size
+    # codes of resolved positions, UNKNOWN until then
+    UNKNOWN = 0xFFFF
+    codes = array('H', [UNKNOWN]) * size
+    # moves not yet known to lose for the side to move, and the longest loss among those that are.
+    # CANNOT_LOSE marks positions with a drawing or winning move out of the table
+    CANNOT_LOSE = 255
+    remaining = array('B', bytes(size))
+    longestLoss = array('H', bytes(2 * size))
+    # ply -> indexes resolved at that ply
+    buckets = {}
+    # edges parent -> child inside the table, collected as two parallel arrays
+    parents = array('I')
+    children = array('I')
+
+    gs = ChessEngine.GameState()
+    for index in range(size):
+        squares, whiteToMove = layout.squares(index)
+        if len(set(squares)) != len(squares) or KING_ATTACKS[squares[0]] >> squares[1] & 1 or \
+                any(piece[1] == 'p' and sq >> 3 in (0, 7) for piece, sq in zip(layout.pieces, squares)):
+            codes[index] = DRAW
+            continue
+        board = [['--'] * 8 for row in range(8)]
+        for piece, sq in zip(layout.pieces, squares):
+            board[sq >> 3][sq & 7] = piece
+        gs.setPosition(board, whiteToMove)
+        enemyKing = gs.blackKingLocation if whiteToMove else gs.whiteKingLocation
+        if gs.getAttackers(enemyKing[0], enemyKing[1], 'w' if whiteToMove else 'b', firstOnly=True):
+            codes[index] = DRAW # the side not to move is in check
+            continue
+        moves = gs.getValidMovesAdvanced()
+        if len(moves) == 0:
+            if gs.checkMate:
+                buckets.setdefault(0, []).append(index)
+            else:
+                codes[index] = DRAW
+            continue
+        count = 0
+        cannotLose = False
+        for move in moves:
+            gs.makeMove(move)
+            if move.pieceCaptured == '--' and not move.isPawnPromotion:
+                pieceSquares = {piece: [row * 8 + col for row, col in squares]
+                                for piece, squares in gs.pieceSquares.items() if squares}
+                parents.append(index)
+                children.append(layout.index(_layoutSquares(layout, pieceSquares), gs.whiteToMove))
+                count += 1
+            else: # the move leaves the table, its value comes from a smaller table
+                result, plies = tablebase.probe(gs) or (DRAW, 0)
+                if result == LOSS: # resolve as a win when its ply comes up, unless a faster win turns up first
+                    buckets.setdefault(plies + 1, []).append(index)
+                    cannotLose = True
+                elif result == WIN:
+                    longestLoss[index] = max(longestLoss[index], plies + 1)
+                else:
+                    cannotLose = True
+            gs.undoMove()
+        if cannotLose:
+            remaining[index] = CANNOT_LOSE
+        elif count == 0: # every move captures or promotes into a lost position
+            buckets.setdefault(longestLoss[index], []).append(index)
+        else:
+            remaining[index] = count
+    tablebase.close()
+    if verbose:
+        print(f"{signature}: {size} positions, {len(children)} moves in {time.perf_counter() - start:.1f}s")
+
+    # predecessors of every position, grouped by child
+    offsets = array('I', bytes(4 * (size + 1)))
+    for child in children:
+        offsets[child + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    fill = array('I', offsets)
+    predecessors = array('I', bytes(4 * len(children)))
+    for parent, child in zip(parents, children):
+        predecessors[fill[child]] = parent
+        fill[child] += 1
+    del parents, children, fill
+
+    ply = 0
+    while buckets:
+        indexes = buckets.pop(ply, ())
+        for index in indexes:
+            if codes[index] != UNKNOWN:
+                continue
+            codes[index] = ply + 1
+            won = ply & 1 # a win for the side to move here is a loss one ply higher for its parents
+            for i in range(offsets[index], offsets[index + 1]):
+                parent = predecessors[i]
+                if codes[parent] != UNKNOWN:
+                    continue
+                if not won:
+                    buckets.setdefault(ply + 1, []).append(parent)
+                elif remaining[parent] != CANNOT_LOSE:
+                    remaining[parent] -= 1
+                    if ply + 1 > longestLoss[parent]:
+                        longestLoss[parent] = ply + 1
+                    if remaining[parent] == 0:
+                        buckets.setdefault(longestLoss[parent], []).append(parent)
+        ply += 1
+
+    for index in range(size):
+        if codes[index] == UNKNOWN:
+            codes[index] = DRAW
+    writeTable(path, layout, codes)
+    if verbose:
+        print(f"{signature}: written to {path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument('signatures', nargs='+',
+                        help=f"material signatures of up to {MAX_PIECES} pieces, e.g. KQvK KRvK KPvK")
+    parser.add_argument('--directory', default='tablebases', help="where tables are written (default tablebases)")
+    args = parser.parse_args(argv)
+    for signature in args.signatures:
+        try:
+            white, black = parseSignature(signature)
+        except ValueError as error:
+            parser.error(str(error))
+        if len(white) + len(black) > MAX_PIECES:
+            parser.error(f"{signature}: at most {MAX_PIECES} pieces are supported")
+    for signature in args.signatures:
+        generateTable(signature, args.directory, verbose=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+'''Batched tensor encoding of positions for machine learning. A batch of GameStates becomes one dense array of shape
+(N, PLANES, 8, 8) indexed [position][plane][row][col]: the board strings of the whole batch are mapped to small
+integer codes in a single pass and the one-hot planes are filled by broadcasting, written into a preallocated
+output buffer or an np.memmap for datasets larger than RAM. decodePositions reverses it'''
+
+import numpy as np
+import ChessEngine
+from CastleRights import WKS, WQS, BKS, BQS
+
+# planes 0-11: one per piece in this order, 12: side to move (all ones when white is to move),
+# 13-16: castle rights WKS, WQS, BKS, BQS (all ones when held), 17: the en passant square
+PIECE_PLANES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+SIDE_TO_MOVE_PLANE = 12
+CASTLE_PLANES = ((13, WKS), (14, WQS), (15, BKS), (16, BQS))
+ENPASSANT_PLANE = 17
+PLANES = 18
+
+# board string -> code, 0 is an empty square and piece codes are plane index + 1
+PIECE_CODES = {piece: i + 1 for i, piece in enumerate(PIECE_PLANES)}
+PIECE_CODES['--'] = 0
+# code -> board string, so a code array can be turned back into boards with one fancy index
+PIECE_NAMES = np.array(('--',) + PIECE_PLANES, dtype=object)
+_PLANE_CODES = np.arange(1, 13, dtype=np.uint8).reshape(1, 12, 1)
+
+'''
+Encode positions into an (N, PLANES, 8, 8) array. states can be any sequence of GameStates of either backend.
+out, if given, is a preallocated array (or memmap) with room for at least N positions and is filled in place
+'''
+def encodePositions(states, out=None, dtype=np.float32):
+    count = len(states)
+    if out is None:
+        out = np.zeros((count, PLANES, 8, 8), dtype=dtype)
+    elif out.shape[0] < count or out.shape[1:] != (PLANES, 8, 8):
+        raise ValueError(f"output buffer of shape {out.shape} can't hold {count} positions")
+    target = out[:count]
+    codes = np.fromiter((PIECE_CODES[piece] for gs in states for row in gs.board for piece in row),
+                        dtype=np.uint8, count=count * 64).reshape(count, 1, 64)
+    target[:, :12] = (codes == _PLANE_CODES).reshape(count, 12, 8, 8)
+
+    sideToMove = np.fromiter((gs.whiteToMove for gs in states), dtype=np.bool_, count=count)
+    target[:, SIDE_TO_MOVE_PLANE] = sideToMove[:, None, None]
+    rights = np.fromiter((gs.currentCastleRights for gs in states), dtype=np.uint8, count=count)
+    for plane, bit in CASTLE_PLANES:
+        target[:, plane] = (rights & bit != 0)[:, None, None]
+
+    target[:, ENPASSANT_PLANE] = 0
+    enpassant = [(i, gs.enpassantPossible) for i, gs in enumerate(states) if gs.enpassantPossible != ()]
+    if enpassant:
+        index = np.array([i for i, square in enpassant])
+        rows = np.array([square[0] for i, square in enpassant])
+        cols = np.array([square[1] for i, square in enpassant])
+        target[index, ENPASSANT_PLANE, rows, cols] = 1
+    return target
+
+'''
+Positions of an (N, PLANES, 8, 8) array as new GameStates of the given engine module
+'''
+def decodePositions(tensors, engine=ChessEngine):
+    tensors = np.asarray(tensors)
+    count = tensors.shape[0]
+    pieces = tensors[:, :12] > 0.5
+    # code of the piece on each square, 0 where no plane is set
+    codes = (pieces * _PLANE_CODES.reshape(1, 12, 1, 1)).max(axis=1)
+    boards = PIECE_NAMES[codes].tolist()
+    sideToMove = (tensors[:, SIDE_TO_MOVE_PLANE, 0, 0] > 0.5).tolist()
+    rights = np.zeros(count, dtype=np.uint8)
+    for plane, bit in CASTLE_PLANES:
+        rights |= np.where(tensors[:, plane, 0, 0] > 0.5, bit, 0).astype(np.uint8)
+    rights = rights.tolist()
+    enpassant = [()] * count
+    for i, row, col in np.argwhere(tensors[:, ENPASSANT_PLANE] > 0.5).tolist():
+        enpassant[i] = (row, col)
+    states = []
+    for i in range(count):
+        gs = engine.GameState()
+        gs.setPosition(boards[i], sideToMove[i], rights[i], enpassant[i])
+        states.append(gs)
+    return states
+
+'''
+Shrink the .npy file at path to its first rows rows: the header gets the new shape, padded to its old length so
+the data doesn't move, and the file is cut after the last row
+'''
+def _truncateNpy(path, rows):
+    with open(path, 'r+b') as file:
+        version = np.lib.format.read_magic(file)
+        readHeader = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortranOrder, dtype = readHeader(file)
+        dataOffset = file.tell()
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortranOrder,
+                       'shape': (rows,) + shape[1:]})
+        sizeBytes = 2 if version == (1, 0) else 4
+        headerLength = dataOffset - len(np.lib.format.magic(*version)) - sizeBytes
+        file.seek(0)
+        file.write(np.lib.format.magic(*version))
+        file.write(headerLength.to_bytes(sizeBytes, 'little'))
+        file.write(header.ljust(headerLength - 1).encode('latin1') + b'\n')
+        file.truncate(dataOffset + rows * dtype.itemsize * int(np.prod(shape[1:])))
+
+'''
+Encode every position of an iterable (e.g. Fen.loadPositions) into a .npy file opened as an np.memmap, batchSize
+positions at a time, so the dataset never has to fit in memory. count is the most positions to write; when the
+iterable runs out first the file is shrunk to the positions written, so reading it back gives no empty rows.
+Returns the memmap of the positions written
+'''
+def encodeToMemmap(states, path, count, batchSize=4096, dtype=np.uint8):
+    sink = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(count, PLANES, 8, 8))
+    written = 0
+    batch = []
+    for gs in states:
+        if written + len(batch) == count:
+            break
+        batch.append(gs)
+        if len(batch) == batchSize:
+            encodePositions(batch, sink[written:written + batchSize])
+            written += batchSize
+            batch = []
+    if batch:
+        encodePositions(batch, sink[written:written + len(batch)])
+        written += len(batch)
+    sink.flush()
+    if written == count:
+        return sink
+    del sink # release the mapping before the file shrinks under it
+    _truncateNpy(path, written)
+    return np.load(path, mmap_mode='r+')
@@ -0,0 +1,74 @@
+from array import array
+
+'''Fixed-size transposition table keyed by zobrist key. Entries live in two preallocated unsigned 64-bit arrays
+(full key, packed data), so memory is set once by the size in MB and never grows.
+The table is split into buckets of two slots: the first keeps the deepest entry, the second is always replaced'''
+
+# bound types, 0 marks an empty slot
+EXACT = 1
+LOWER = 2 # score is at least this (fail high)
+UPPER = 3 # score is at most this (fail low)
+
+ENTRY_BYTES = 16 # one key and one data word per slot
+SCORE_OFFSET = 1 << 31
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        slots = max(2, sizeMB * 1024 * 1024 // ENTRY_BYTES)
+        buckets = 1
+        while buckets * 4 <= slots:
+            buckets *= 2
+        self.bucketMask = buckets - 1
+        self.keys = array('Q', bytes(8 * 2 * buckets))
+        self.data = array('Q', bytes(8 * 2 * buckets))
+        self.age = 0
+
+    '''
+    Start a new search. Entries from older searches become replaceable regardless of depth
+    '''
+    def newSearch(self):
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        size = len(self.keys)
+        self.keys = array('Q', bytes(8 * size))
+        self.data = array('Q', bytes(8 * size))
+        self.age = 0
+
+    '''
+    Returns (depth, bound, score, packed move) for key, or None if the position is not stored
+    '''
+    def probe(self, key):
+        slot = (key & self.bucketMask) << 1
+        keys = self.keys
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                return None
+        data = self.data[slot]
+        bound = (data >> 24) & 3
+        if bound == 0:
+            return None
+        return (data >> 16) & 255, bound, ((data >> 26) & 0xFFFFFFFF) - SCORE_OFFSET, data & 0xFFFF
+
+    '''
+    Store an entry. The depth-preferred slot is taken if it holds this position, a shallower search or an
+    entry from an older search; otherwise the always-replace slot is overwritten
+    '''
+    def store(self, key, depth, bound, score, packedMove):
+        slot = (key & self.bucketMask) << 1
+        depth = max(0, min(depth, 255))
+        data = packedMove | depth << 16 | bound << 24 | (score + SCORE_OFFSET) << 26 | self.age << 58
+        old = self.data[slot]
+        if self.keys[slot] != key and (old >> 16) & 255 > depth and old >> 58 == self.age:
+            slot += 1
+        self.keys[slot] = key
+        self.data[slot] = data
+
+    '''
+    Approximate permille of slots used by the current search, sampled from the first thousand slots
+    '''
+    def hashfull(self):
+        sample = min(1000, len(self.data))
+        used = sum(1 for i in range(sample) if (self.data[i] >> 24) & 3 and self.data[i] >> 58 == self.age)
+        return used * 1000 // sample
@@ -0,0 +1,32 @@
+import random
+
+'''Zobrist hashing. Every (piece, square), castle rights combination, en passant file and the side to move gets a
+fixed random 64-bit key; a position's key is the XOR of the keys of its features, so makeMove/undoMove can keep it
+up to date by XOR-ing in only the features that change'''
+
+_random = random.Random(20240611) # fixed seed, so keys are the same in every process
+
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+# piece -> row -> col -> key
+PIECE_KEYS = {piece: [[_random.getrandbits(64) for col in range(8)] for row in range(8)] for piece in PIECES}
+# indexed by the 4-bit castle rights, so updating rights is a single XOR of the old and new entries
+CASTLE_KEYS = [_random.getrandbits(64) for i in range(16)]
+ENPASSANT_KEYS = [_random.getrandbits(64) for col in range(8)]
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+
+'''
+Key of a position computed from scratch. Only used to seed a GameState and to check the incremental key
+'''
+def computeKey(board, whiteToMove, castleRights, enpassantPossible):
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != '--':
+                key ^= PIECE_KEYS[piece][row][col]
+    key ^= CASTLE_KEYS[castleRights]
+    if enpassantPossible != ():
+        key ^= ENPASSANT_KEYS[enpassantPossible[1]]
+    if not whiteToMove:
+        key ^= BLACK_TO_MOVE_KEY
+    return key